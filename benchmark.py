@@ -0,0 +1,276 @@
+import subprocess
+import tempfile
+import argparse
+import random
+import socket
+import json
+import csv
+import sys
+import os
+
+import wire
+from cluster import default_cluster, write_cluster
+
+# Network profile without the lab's emulated delays, so the code path itself is measured
+NO_DELAY_CONFIG = {
+    'default': {'dist': 'fixed', 'delay': 0},
+    'release_delay': 0,
+    'insert_pause': 0
+}
+DEFAULT_MIX = 'insert=20,lookup=75,dictionary=5'
+PERCENTILES = [50, 95, 99]
+STATS_TIMEOUT = 5
+
+def parse_mix(spec):
+    """Parse 'insert=20,lookup=75,...' into {op: weight}"""
+    mix = {}
+    for item in spec.split(','):
+        if item.strip():
+            op, weight = item.split('=', 1)
+            mix[op.strip()] = float(weight)
+    return mix
+
+def key_weights(keys, skew):
+    """Cumulative Zipf weights over perms 1..keys (skew 0 = uniform)"""
+    cumulative = []
+    total = 0.0
+    for rank in range(1, keys + 1):
+        total += 1.0 / rank ** skew
+        cumulative.append(total)
+    return cumulative
+
+def workload_commands(ops, mix, keys, skew, targets, batch_size, seed):
+    """Generate synthetic master input lines"""
+    rng = random.Random(seed)
+    perms = list(range(1, keys + 1))
+    rng.shuffle(perms)  # Hot keys are not simply the smallest perms
+    cumulative = key_weights(keys, skew)
+    op_names = list(mix)
+    op_weights = [mix[op] for op in op_names]
+
+    def perm():
+        return rng.choices(perms, cum_weights=cumulative)[0]
+
+    for i in range(ops):
+        op = rng.choices(op_names, weights=op_weights)[0]
+        client_id = rng.choice(targets)
+        if op == 'insert':
+            yield f"insert {perm()} G{i} {client_id}"
+        elif op == 'batch_insert':
+            entries = ' '.join(f"{perm()} G{i}.{j}" for j in range(batch_size))
+            yield f"batch_insert {entries} {client_id}"
+        elif op == 'lookup':
+            yield f"lookup {perm()} {client_id}"
+        elif op == 'dictionary':
+            yield f"dictionary {client_id}"
+        else:
+            raise ValueError(f"unknown command type '{op}' in mix")
+
+def generate_workload(path, ops, mix, keys, skew, targets, batch_size, seed):
+    """Write a synthetic master input file"""
+    with open(path, 'w') as f:
+        for command in workload_commands(ops, mix, keys, skew, targets, batch_size, seed):
+            f.write(command + '\n')
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    rank = max(1, -(-pct * len(values) // 100))
+    return values[int(rank) - 1]
+
+def read_latencies(path):
+    """Read the master's latency log into {op: [latency_ms]} plus the first start and last completion"""
+    latencies = {}
+    first, last = None, None
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            # Latency runs from when the command was due, which is when it was sent unless open-loop
+            started, latency_ms = float(row.get('intended_at') or row['sent_at']), float(row['latency_ms'])
+            latencies.setdefault(row['op'], []).append(latency_ms)
+            first = started if first is None else min(first, started)
+            last = max(last or 0, started + latency_ms / 1000)
+    return latencies, first, last
+
+def query_stats(address):
+    """Ask one client for its peer message counters"""
+    with socket.create_connection(address, timeout=STATS_TIMEOUT) as sock:
+        sock.sendall(wire.encode({'type': 'MASTER_STATS', 'req_id': 0}))
+        reader = wire.FrameReader()
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return None
+            reader.feed(data)
+            message = reader.next_message()
+            if message is not None:
+                return message
+
+def summarize(latencies, first, last, stats):
+    """Build the results dict"""
+    results = {'latency_ms': {}, 'messages': {}}
+    completed = sum(len(values) for values in latencies.values())
+    duration = (last - first) if completed else 0
+    results['completed'] = completed
+    results['duration_s'] = round(duration, 3)
+    results['throughput_ops_s'] = round(completed / duration, 1) if duration > 0 else None
+    for op, values in sorted(latencies.items()):
+        values.sort()
+        summary = {'count': len(values), 'mean': round(sum(values) / len(values), 3)}
+        for pct in PERCENTILES:
+            summary[f"p{pct}"] = percentile(values, pct)
+        results['latency_ms'][op] = summary
+
+    by_type = {}
+    for client_stats in stats.values():
+        for msg_type, count in client_stats.get('sent', {}).items():
+            by_type[msg_type] = by_type.get(msg_type, 0) + count
+    total = sum(by_type.values())
+    writes = sum(client_stats.get('metrics', {}).get('counters', {}).get('socket_writes', 0)
+                 for client_stats in stats.values())
+    results['messages'] = {
+        'total': total,
+        'per_op': round(total / completed, 3) if completed else None,
+        'by_type': dict(sorted(by_type.items())),
+        'socket_writes': writes,
+        'writes_per_op': round(writes / completed, 3) if completed else None
+    }
+    return results
+
+def git_revision():
+    """Short commit id of the tree being benchmarked, if known"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmark(args):
+    """Launch a local cluster, replay the workload through the master and collect results"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cs171-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    members = default_cluster(args.baseport, args.nodes)
+    cluster_file = os.path.join(workdir, 'cluster.json')
+    write_cluster(cluster_file, members)
+
+    workload = args.workload
+    if workload is None:
+        workload = os.path.join(workdir, 'workload.txt')
+        targets = [int(t) for t in args.targets.split(',')] if args.targets else sorted(members)
+        generate_workload(workload, args.ops, parse_mix(args.mix), args.keys, args.skew, targets,
+                          args.batchsize, args.seed)
+    netdelay = args.netdelay
+    if netdelay is None:
+        netdelay = os.path.join(workdir, 'netdelay.json')
+        with open(netdelay, 'w') as f:
+            json.dump(NO_DELAY_CONFIG, f)
+    latency_file = os.path.join(workdir, 'latency.csv')
+
+    client_args = ['-cluster', cluster_file, '-netdelay', netdelay, '-runtime', args.runtime,
+                   '-mutex', args.mutex, '-wire', args.wire, '-store', args.store,
+                   '-coalesce', str(args.coalesce), '-partitions', args.partitions]
+    master_args = ['-cluster', cluster_file, '-netdelay', netdelay, '-wire', args.wire,
+                   '-pipeline', str(args.pipeline), '-inputfile', workload,
+                   '-outputfile', os.path.join(workdir, 'output.txt'), '-latencyfile', latency_file, '-stream']
+    if args.openloop:
+        master_args += ['-openloop', args.openloop]
+
+    print(f"Benchmark: {args.nodes} clients, workload {workload}, logs in {workdir}")
+    clients = []
+    stats = {}
+    try:
+        for client_id in sorted(members):
+            log = open(os.path.join(workdir, f"client{client_id}.log"), 'w')
+            clients.append((subprocess.Popen([sys.executable, os.path.join(here, 'client.py'),
+                                              '-client', str(client_id)] + client_args,
+                                             stdout=log, stderr=subprocess.STDOUT), log))
+        with open(os.path.join(workdir, 'master.log'), 'w') as log:
+            master = subprocess.run([sys.executable, os.path.join(here, 'master.py')] + master_args,
+                                    stdout=log, stderr=subprocess.STDOUT, timeout=args.timeout)
+        if master.returncode != 0:
+            print(f"Benchmark: master exited with status {master.returncode}")
+        for client_id, address in sorted(members.items()):
+            try:
+                stats[client_id] = query_stats(address) or {}
+            except OSError as e:
+                print(f"Benchmark: no stats from Client {client_id}: {e}")
+    finally:
+        for process, log in clients:
+            process.terminate()
+            process.wait()
+            log.close()
+
+    latencies, first, last = read_latencies(latency_file)
+    results = summarize(latencies, first, last, stats)
+    results['config'] = {
+        'revision': git_revision(),
+        'nodes': args.nodes,
+        'ops': args.ops,
+        'workload': args.workload,
+        'mix': args.mix,
+        'keys': args.keys,
+        'skew': args.skew,
+        'targets': args.targets,
+        'batchsize': args.batchsize,
+        'pipeline': args.pipeline,
+        'openloop': args.openloop,
+        'runtime': args.runtime,
+        'mutex': args.mutex,
+        'wire': args.wire,
+        'store': args.store,
+        'netdelay': args.netdelay,
+        'coalesce': args.coalesce,
+        'partitions': args.partitions,
+        'seed': args.seed
+    }
+    return results
+
+def print_results(results):
+    """Human-readable summary"""
+    print(f"Completed {results['completed']} commands in {results['duration_s']} s "
+          f"({results['throughput_ops_s']} ops/s)")
+    print(f"{'command':<18}{'count':>8}{'mean':>10}" + ''.join(f"{'p' + str(pct):>10}" for pct in PERCENTILES))
+    for op, summary in results['latency_ms'].items():
+        print(f"{op:<18}{summary['count']:>8}{summary['mean']:>10.2f}"
+              + ''.join(f"{summary['p' + str(pct)]:>10.2f}" for pct in PERCENTILES))
+    messages = results['messages']
+    print(f"Peer messages: {messages['total']} ({messages['per_op']} per command) {messages['by_type']}")
+    print(f"Socket writes: {messages['socket_writes']} ({messages['writes_per_op']} per command)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a synthetic workload against a local cluster')
+    parser.add_argument('-ops', type=int, default=1000, help='Number of commands to generate')
+    parser.add_argument('-mix', type=str, default=DEFAULT_MIX,
+                        help='Command weights, from insert, batch_insert, lookup and dictionary')
+    parser.add_argument('-keys', type=int, default=1000, help='Number of distinct perms')
+    parser.add_argument('-skew', type=float, default=0.0, help='Zipf exponent for perm popularity (0 = uniform)')
+    parser.add_argument('-targets', type=str, default=None, help='Clients to send commands to, e.g. 1,2 (default all)')
+    parser.add_argument('-batchsize', type=int, default=10, help='Entries per batch_insert')
+    parser.add_argument('-workload', type=str, default=None, help='Replay this input file instead of generating one')
+    parser.add_argument('-nodes', type=int, default=3, help='Cluster size')
+    parser.add_argument('-baseport', type=int, default=9601, help='Port of client 1; the others follow it')
+    parser.add_argument('-pipeline', type=int, default=16, help='Master pipeline window (0 = serial)')
+    parser.add_argument('-openloop', type=str, default=None,
+                        help='Offer load on a schedule (rate:N, poisson:N[:SEED]) instead of a pipeline window')
+    parser.add_argument('-runtime', choices=['thread', 'asyncio'], default='thread')
+    parser.add_argument('-mutex', choices=['lamport', 'ricart', 'token'], default='lamport')
+    parser.add_argument('-wire', choices=['json', 'binary'], default='json')
+    parser.add_argument('-store', choices=['dict', 'compact'], default='dict')
+    parser.add_argument('-netdelay', type=str, default=None, help='Delay profile (default: no emulated delay)')
+    parser.add_argument('-coalesce', type=float, default=0.0, help='Client write coalescing window in ms')
+    parser.add_argument('-partitions', type=str, default='1', help="Client lock partitions, e.g. 8 or 'range:500'")
+    parser.add_argument('-seed', type=int, default=1)
+    parser.add_argument('-timeout', type=float, default=600, help='Seconds to let the master run')
+    parser.add_argument('-workdir', type=str, default=None, help='Directory for the workload, logs and latency log')
+    parser.add_argument('-results', type=str, default='benchmark.json', help='JSON results file')
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    print_results(results)
+    with open(args.results, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"Results written to {args.results}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1155 @@
+import socket
+import threading
+import json
+import time
+import argparse
+import asyncio
+import sys
+from collections import deque
+
+import wire
+from request_queue import RequestQueue
+from netdelay import NetworkEmulator, TimerWheel
+from store import STORE_DICT, STORE_COMPACT, make_store
+from wal import WriteAheadLog
+from cluster import DEFAULT_HOST, backoff, default_cluster, resolve_cluster
+from metrics import Metrics, TimedLock, serve_stats
+from eventlog import LEVELS, make_log
+from outbound import OutboundQueue, set_nodelay
+from partition import HashPartitioner, parse_partitions
+
+# Mutual exclusion algorithms
+MUTEX_LAMPORT = 'lamport'
+MUTEX_RICART_AGRAWALA = 'ricart'
+MUTEX_TOKEN = 'token'  # Suzuki-Kasami
+
+# Messages from the master are not subject to the simulated network delay
+MASTER_MESSAGES = ['MASTER_INSERT', 'MASTER_BATCH_INSERT', 'MASTER_LOOKUP', 'MASTER_DICTIONARY',
+                   'MASTER_DICTIONARY_SINCE', 'MASTER_STATS']
+STREAM_LIMIT = 1 << 24
+DICTIONARY_CHUNK_SIZE = 1000  # Entries per DICTIONARY_CHUNK
+
+class InsertRequest:
+    """One insert this client is taking through mutual exclusion"""
+    def __init__(self, rid, entries, batch, req_id, master):
+        self.rid = rid  # Our request id, carried by REQUEST, REPLY, INSERT, SUCCESS and RELEASE
+        self.entries = entries  # [(perm, grade), ...] applied in one critical section
+        self.batch = batch
+        self.req_id = req_id  # Master request id echoed in INSERT_SUCCESS
+        self.master = master  # Master connection that asked for the insert
+        self.clock = None  # Lamport timestamp of our REQUEST
+        self.parts = [0]  # Lock partitions the entries fall in
+        self.replies = set()
+        self.successes = set()
+        self.lsn = None  # WAL record of our last applied entry
+        self.requested_at = None  # When our REQUEST went out
+        self.entered_at = None  # When we entered the critical section
+        self.join = False  # A restarted client catching up: locks every partition and inserts nothing
+
+class Token:
+    """Suzuki-Kasami privilege token: the last request granted per client, and clients waiting for it"""
+    def __init__(self, granted, queue=()):
+        self.granted = granted  # client_id -> request number last served
+        self.queue = deque(queue)
+        
+    def to_message(self, sender, clock):
+        return {
+            'type': 'TOKEN',
+            'from': sender,
+            'clock': clock,
+            'granted': [[client_id, number] for client_id, number in self.granted.items()],
+            'queue': list(self.queue)
+        }
+        
+    @classmethod
+    def from_message(cls, message):
+        return cls({client_id: number for client_id, number in message['granted']}, message['queue'])
+
+class Client:
+    def __init__(self, client_id, port, peers, wire_format=wire.FORMAT_JSON, network_config=None,
+                 mutex=MUTEX_LAMPORT, host=DEFAULT_HOST, datadir=None, snapshot_every=50000,
+                 store=STORE_DICT, log=None, coalesce=0.0, partitions=None, rejoin=False):
+        self.client_id = client_id
+        self.log = log or make_log(f"client{client_id}", f"Client {client_id}")
+        self.host = host
+        self.port = port
+        self.peers = peers  # other client_id -> (host, port)
+        self.dictionary = make_store(store)
+        self.lamport_clock = 0
+        
+        # The lock space is split into partitions, each with its own request queue;
+        # inserts whose entries fall in different partitions hold the lock in parallel
+        self.partitions = partitions or HashPartitioner(1)
+        self.request_queues = [RequestQueue() for _ in range(self.partitions.count)]  # ordered by (timestamp, client_id)
+        self.in_critical_section = False
+        
+        # Our inserts, each with its own request id; any number may be outstanding
+        self.next_rid = 0
+        self.requests = {}  # rid -> InsertRequest that has sent its REQUEST
+        self.request_clocks = {}  # Timestamp of each of our queued requests -> rid
+        self.peer_requests = {}  # (client_id, rid) -> (timestamp, partitions) of a peer's queued request
+        self.active = {}  # rid -> InsertRequest in the critical section
+        self.backlog = deque()  # Inserts waiting to send their REQUEST (Ricart-Agrawala only)
+        
+        # Message, byte, queue and timing metrics, served by -statsport
+        self.metrics = Metrics(f"client{client_id}")
+        self.metrics.gauge('request_queue_depth', lambda: sum(len(q) for q in self.request_queues))
+        self.metrics.gauge('deferred_replies', lambda: len(self.deferred_replies))
+        self.metrics.gauge('in_critical_section', lambda: self.in_critical_section)
+        self.metrics.gauge('outstanding_inserts', lambda: len(self.requests) + len(self.backlog))
+        self.metrics.gauge('outbound_queued', lambda: sum(len(q) for q in list(self.outbound.values())))
+        self.metrics.gauge('peers_down', lambda: len(self.down))
+        self.lock = TimedLock(self.metrics, 'lock_hold_ms')
+        
+        # Lamport (request queue + RELEASE) or Ricart-Agrawala (deferred replies)
+        self.mutex = mutex
+        self.deferred_replies = []  # (client_id, rid) of requests we have not answered yet
+        
+        # Suzuki-Kasami: the token starts with the lowest client id and entering needs only the token
+        members = sorted([client_id] + list(peers))
+        self.request_numbers = {member: 0 for member in members}  # Highest request number seen per client
+        self.token = None
+        if mutex == MUTEX_TOKEN:
+            if client_id == members[0]:
+                self.token = Token({member: 0 for member in members})
+            self.metrics.gauge('holding_token', lambda: self.token is not None)
+        self.token_requested = False
+        
+        # Socket connections
+        self.server_socket = None
+        self.client_sockets = {}
+        self.master_connection = None
+        
+        # Per-connection send queues, so socket writes never happen under self.lock
+        self.outbound = {}  # conn -> OutboundQueue
+        self.outbound_lock = threading.Lock()
+        self.coalesce = coalesce  # Seconds a writer waits to batch more messages into one write
+        
+        # Wire format offered to peers, and the format agreed per connection
+        self.wire_offer = wire.SUPPORTED_FORMATS if wire_format == wire.FORMAT_BINARY else [wire.FORMAT_JSON]
+        self.wire_formats = {}
+        
+        # Emulated network delays; the runtime supplies the timer scheduler
+        self.network = NetworkEmulator(network_config)
+        
+        # Startup: READY goes to the master once every peer link is up
+        self.ready = False
+        self.ready_waiters = []  # Master connections that sent HELLO too early
+        self.links_up = False
+        
+        # Crashed peers: nobody waits on them, and they are dialed until they are back.
+        # A restarted client (rejoin) first waits for every peer's WELCOME, then
+        # locks every partition and copies a peer's dictionary before it is READY.
+        self.down = set()
+        self.rejoining = rejoin
+        self.welcomes_missing = set(peers) if rejoin else set()
+        
+        # Durable log of applied inserts; restore the dictionary from it first
+        self.wal = None
+        if datadir:
+            started = time.time()
+            self.wal = WriteAheadLog(datadir, snapshot_every=snapshot_every, on_error=self.background_failed)
+            count = self.wal.recover(self.dictionary)
+            self.log.info('RECOVERED', "recovered {count} entries (version {version}) from {datadir} in {ms:.1f} ms",
+                          count=count, version=self.dictionary.version, datadir=datadir,
+                          ms=(time.time() - started) * 1000)
+        
+    def start_server(self):
+        """Start listening for incoming connections"""
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(5)
+        self.log.info('LISTENING', "listening on port {port}", port=self.port)
+        
+        while True:
+            try:
+                conn, addr = self.server_socket.accept()
+                set_nodelay(conn)
+                threading.Thread(target=self.handle_connection, args=(conn,), daemon=True).start()
+            except:
+                break
+                
+    def handle_connection(self, conn):
+        """Handle incoming messages"""
+        reader = wire.FrameReader()
+        while True:
+            try:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                    
+                self.metrics.inc('bytes_received', len(data))
+                reader.feed(data)
+                for message in reader:
+                    if message.get('type') == 'WIRE_HELLO':
+                        self.accept_wire_hello(conn, reader, message)
+                        continue
+                    if message.get('type') == 'HELLO':
+                        self.accept_hello(conn)
+                        continue
+                    self.deliver(message, conn)
+            except Exception as e:
+                self.log.error('CONNECTION_ERROR', "error handling connection: {error}", error=e)
+                break
+        self.close_outbound(conn)
+        self.wire_formats.pop(conn, None)
+        conn.close()
+        
+    def accept_wire_hello(self, conn, reader, message):
+        """Answer a WIRE_HELLO and switch the connection to the agreed format"""
+        fmt = wire.choose_format(message.get('formats', []))
+        self.write_message(conn, {'type': 'WIRE_ACK', 'format': fmt})
+        self.wire_formats[conn] = fmt
+        reader.format = fmt
+        
+    def connect_to_clients(self):
+        """Connect to all other clients in parallel, then report ready"""
+        threads = [threading.Thread(target=self.connect_to_client, args=(other_id, other_host, other_port), daemon=True)
+                   for other_id, (other_host, other_port) in self.peers.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.links_ready()
+        
+    def connect_to_client(self, other_id, other_host, other_port):
+        """Connect to one other client, retrying with backoff until it is up"""
+        for delay in backoff():
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.connect((other_host, other_port))
+                set_nodelay(sock)
+                self.wire_formats[sock], _ = wire.negotiate(sock, self.wire_offer)
+            except OSError:
+                sock.close()
+                time.sleep(delay)
+                continue
+            self.log.info('CONNECTED', "connected to Client {peer}", peer=other_id)
+            self.link_up(other_id, sock)
+            threading.Thread(target=self.watch_peer, args=(other_id, sock), daemon=True).start()
+            return
+            
+    def watch_peer(self, other_id, sock):
+        """Wait on a link we dialed until it closes; peers never write on it, so that means the peer is gone"""
+        try:
+            while sock.recv(4096):
+                pass
+        except OSError:
+            pass
+        self.peer_lost(other_id, sock)
+        
+    def redial(self, other_id):
+        """Dial a peer that went down until it is back"""
+        other_host, other_port = self.peers[other_id]
+        threading.Thread(target=self.connect_to_client, args=(other_id, other_host, other_port), daemon=True).start()
+        
+    def link_up(self, other_id, conn):
+        """Start sending to a peer on a new link; a peer that was down is welcomed back first"""
+        with self.lock:
+            self.client_sockets[other_id] = conn
+            if other_id in self.down:
+                self.peer_up(other_id)
+                
+    def peer_lost(self, other_id, conn):
+        """Our link to a peer closed; act on it only after everything the peer sent before that"""
+        self.log.warning('PEER_LOST', "lost connection to Client {peer}", peer=other_id)
+        self.network.after_link(other_id, self.client_id, self.peer_down, other_id, conn)
+        
+    def peer_down(self, other_id, conn):
+        """Stop waiting on a peer that went away, forget its requests and dial it until it is back"""
+        with self.lock:
+            if self.client_sockets.get(other_id) is not conn:
+                return  # A newer link has replaced this one
+            del self.client_sockets[other_id]
+            self.down.add(other_id)
+            self.log.warning('PEER_DOWN', "Client {peer} is down; continuing without it", peer=other_id)
+            
+            # Its queued requests will never be released, and deferred replies cannot reach it
+            for key in [key for key in self.peer_requests if key[0] == other_id]:
+                timestamp, parts = self.peer_requests.pop(key)
+                for part in parts:
+                    self.request_queues[part].remove(other_id, timestamp)
+            self.deferred_replies = [(peer, rid) for peer, rid in self.deferred_replies if peer != other_id]
+            
+            # Our requests stop waiting for its REPLY and SUCCESS; it catches up when it rejoins
+            for request in list(self.requests.values()):
+                request.replies.add(other_id)
+                if request.rid in self.active and request.join:
+                    self.request_sync(request)  # It may have been the peer we were copying from
+                elif request.rid in self.active:
+                    request.successes.add(other_id)
+                    if len(request.successes) == len(self.peers):
+                        self.finish_insert(request)
+            self.try_enter_critical_section()
+        self.close_outbound(conn)
+        conn.close()
+        self.redial(other_id)
+        
+    def peer_up(self, other_id):
+        """Welcome back a restarted peer with our clock and queued requests (caller holds self.lock)"""
+        self.down.discard(other_id)
+        self.log.info('PEER_UP', "Client {peer} is back", peer=other_id)
+        requests = []
+        if self.mutex == MUTEX_LAMPORT:
+            requests = [[request.rid, request.clock, request.parts] for request in self.requests.values()]
+        self.send_message(other_id, {
+            'type': 'WELCOME',
+            'from': self.client_id,
+            'clock': self.lamport_clock,
+            'requests': requests
+        })
+        
+    def accept_hello(self, conn):
+        """Answer the master's HELLO with READY, or once all peers are connected"""
+        with self.lock:
+            if not self.ready:
+                self.ready_waiters.append(conn)
+                return
+        self.send_ready(conn)
+        
+    def links_ready(self):
+        """Every peer link is up: report ready, or first catch up if we are rejoining"""
+        with self.lock:
+            self.links_up = True
+            if self.rejoining:
+                self.start_join()
+            else:
+                self.mark_ready()
+                
+    def mark_ready(self):
+        """Release masters waiting for READY (caller holds self.lock)"""
+        self.ready = True
+        waiters, self.ready_waiters = self.ready_waiters, []
+        for conn in waiters:
+            self.send_ready(conn)
+            
+    def start_join(self):
+        """Once every link is up and every peer has welcomed us, lock everything to copy a peer's dictionary"""
+        if not self.links_up or self.welcomes_missing:
+            return
+        self.next_rid += 1
+        request = InsertRequest(self.next_rid, [], False, None, None)
+        request.join = True
+        self.log.info('REJOIN', "rejoining: locking every partition to copy a peer's dictionary")
+        self.send_request(request)
+        
+    def send_ready(self, conn):
+        """Tell the master this client can take commands"""
+        self.log.info('READY', "[Event - READY] - [Sent to Master]")
+        try:
+            self.write_message(conn, {'type': 'READY', 'from': self.client_id})
+        except Exception as e:
+            self.log.error('SEND_ERROR', "error sending to master: {error}", error=e)
+            
+    def send_message(self, recipient_id, message):
+        """Send message to another client"""
+        try:
+            if recipient_id == 'master':
+                conn = self.master_connection
+            else:
+                conn = self.client_sockets.get(recipient_id)
+                self.metrics.inc('messages_sent', label=message['type'])
+            if conn:
+                self.write_message(conn, message)
+        except Exception as e:
+            self.log.error('SEND_ERROR', "error sending to {peer}: {error}", peer=recipient_id, error=e)
+            
+    def write_message(self, conn, message):
+        """Queue one message for a connection's writer thread"""
+        self.outbound_queue(conn).put(message, self.wire_formats.get(conn, wire.FORMAT_JSON))
+        
+    def outbound_queue(self, conn):
+        """The send queue for a connection, started on first use"""
+        with self.outbound_lock:
+            outbound = self.outbound.get(conn)
+            if outbound is None:
+                name = next((f"Client {other_id}" for other_id, sock in self.client_sockets.items() if sock is conn),
+                            'master')
+                outbound = OutboundQueue(conn, name, self.count_write, self.outbound_failed, self.coalesce)
+                self.outbound[conn] = outbound
+            return outbound
+            
+    def count_write(self, size, messages):
+        """Account for one socket write carrying messages"""
+        self.metrics.inc('bytes_sent', size)
+        self.metrics.inc('socket_writes')
+        self.metrics.observe('messages_per_write', messages)
+        
+    def outbound_failed(self, name, error):
+        """A writer thread could not send to its connection"""
+        self.log.error('SEND_ERROR', "error sending to {peer}: {error}", peer=name, error=error)
+        
+    def background_failed(self, what, error):
+        """A timer, WAL or snapshot thread hit an error"""
+        self.log.error('BACKGROUND_ERROR', "{what} error: {error}", what=what, error=error)
+        
+    def close_outbound(self, conn):
+        """Stop the writer for a closed connection"""
+        with self.outbound_lock:
+            outbound = self.outbound.pop(conn, None)
+        if outbound is not None:
+            outbound.close()
+        
+    def deliver(self, message, conn):
+        """Process a received message once its emulated network delay has passed"""
+        src = 'master' if message.get('type') in MASTER_MESSAGES else message.get('from')
+        if src != 'master':
+            self.metrics.inc('messages_received', label=message.get('type'))
+        self.network.deliver(src, self.client_id, message, self.process_message, message, conn)
+        
+    def run_threadsafe(self, callback):
+        """Run callback from another thread (the threaded runtime just calls it)"""
+        callback()
+        
+    def apply_insert(self, perm, grade):
+        """Apply one entry to the dictionary and log it; returns its WAL lsn"""
+        if not self.dictionary.accepts(perm):
+            # Masters' inserts are checked on arrival; never fail halfway through the protocol
+            self.log.error('INSERT_REJECTED', "cannot store perm {perm}, skipped", perm=perm)
+            return None
+        version = self.dictionary.set(perm, grade)
+        if self.wal is None:
+            return None
+        lsn = self.wal.append(version, perm, grade)
+        self.wal.maybe_snapshot(self.dictionary)
+        return lsn
+        
+    def when_durable(self, lsn, callback):
+        """Run callback once the WAL record lsn is on disk (at once without a WAL)"""
+        if self.wal is None or lsn is None:
+            callback()
+        else:
+            self.wal.after_durable(lsn, lambda: self.run_threadsafe(callback))
+            
+    def call_later(self, delay, callback):
+        """Run callback after delay seconds without blocking the caller"""
+        self.network.scheduler.call_later(delay, callback)
+            
+    def process_message(self, message, conn=None):
+        """Process incoming messages"""
+        msg_type = message.get('type')
+        
+        with self.lock:
+            if msg_type == 'MASTER_INSERT':
+                # Master wants us to insert
+                self.master_connection = conn
+                perm = message['perm']
+                grade = message['grade']
+                if self.check_insert([(perm, grade)], message.get('req_id'), conn):
+                    self.start_insert([(perm, grade)], message.get('req_id'), conn)
+                
+            elif msg_type == 'MASTER_BATCH_INSERT':
+                # Master wants us to insert many grades under one mutual exclusion
+                self.master_connection = conn
+                entries = [(perm, grade) for perm, grade in message['entries']]
+                if self.check_insert(entries, message.get('req_id'), conn):
+                    self.start_insert(entries, message.get('req_id'), conn, batch=True)
+                
+            elif msg_type == 'MASTER_LOOKUP':
+                # Master wants us to lookup
+                self.master_connection = conn
+                perm = message['perm']
+                result = self.dictionary.get(perm, 'NOT FOUND')
+                response = {
+                    'type': 'LOOKUP_RESULT',
+                    'perm': perm,
+                    'grade': result,
+                    'clock': self.lamport_clock,
+                    'req_id': message.get('req_id')
+                }
+                self.write_message(conn, response)
+                
+            elif msg_type == 'MASTER_DICTIONARY':
+                # Master wants dictionary state
+                self.master_connection = conn
+                response = {
+                    'type': 'DICTIONARY_RESULT',
+                    'dictionary': self.dictionary.snapshot(),
+                    'version': self.dictionary.version,
+                    'clock': self.lamport_clock,
+                    'req_id': message.get('req_id')
+                }
+                self.send_message('master', response)
+                
+            elif msg_type == 'MASTER_DICTIONARY_SINCE':
+                # Master wants only what changed after a version it already has
+                self.master_connection = conn
+                self.send_dictionary_since(conn, message['version'], message.get('req_id'),
+                                           message.get('chunk', DICTIONARY_CHUNK_SIZE))
+                
+            elif msg_type == 'MASTER_STATS':
+                # Message counters, for benchmarks
+                self.write_message(conn, {
+                    'type': 'STATS_RESULT',
+                    'from': self.client_id,
+                    'sent': self.metrics.counter('messages_sent'),
+                    'received': self.metrics.counter('messages_received'),
+                    'metrics': self.metrics.snapshot(),
+                    'req_id': message.get('req_id')
+                })
+                
+            elif msg_type == 'REQUEST':
+                # Another client wants mutual exclusion
+                self.lamport_clock = max(self.lamport_clock, message['clock']) + 1
+                self.log.info('REQUEST', "[Event - REQUEST] - [Clock - {clock}] - [Received from Client {peer}]", clock=message['clock'], peer=message['from'], rid=message['rid'])
+                self.log.info('CLOCK', "Clock Value {old} -> {new}", old=self.lamport_clock - 1, new=self.lamport_clock)
+                
+                if self.mutex == MUTEX_RICART_AGRAWALA:
+                    # Hold the reply while we are in, or have priority for, the critical section
+                    waiting = next(iter(self.requests.values()), None)
+                    if self.active or (waiting is not None and
+                                                   (waiting.clock, self.client_id) < (message['clock'], message['from'])):
+                        self.log.info('DEFERRED', "[Event - REPLY] - [Clock - {clock}] - [Deferred for Client {peer}]", clock=self.lamport_clock, peer=message['from'], rid=message['rid'])
+                        self.deferred_replies.append((message['from'], message['rid']))
+                    else:
+                        self.send_reply(message['from'], message['rid'])
+                else:
+                    # Add to the queue of each partition it locks
+                    parts = message.get('parts', [0])
+                    for part in parts:
+                        self.request_queues[part].push(message['clock'], message['from'])
+                    self.peer_requests[(message['from'], message['rid'])] = (message['clock'], parts)
+                    self.send_reply(message['from'], message['rid'])
+                
+            elif msg_type == 'TOKEN_REQUEST':
+                # Another client wants the token
+                self.lamport_clock = max(self.lamport_clock, message['clock']) + 1
+                self.log.info('TOKEN_REQUEST', "[Event - TOKEN_REQUEST] - [Clock - {clock}] - [Received from Client {peer}]", clock=message['clock'], peer=message['from'], number=message['number'])
+                sender = message['from']
+                self.request_numbers[sender] = max(self.request_numbers[sender], message['number'])
+                
+                # An idle holder hands the token straight over if the request is outstanding
+                if (self.token is not None and not self.active and
+                        self.request_numbers[sender] == self.token.granted[sender] + 1):
+                    self.pass_token(sender)
+                    
+            elif msg_type == 'TOKEN':
+                # The token has arrived; we may enter
+                self.lamport_clock = max(self.lamport_clock, message['clock']) + 1
+                self.log.info('TOKEN', "[Event - TOKEN] - [Clock - {clock}] - [Received from Client {peer}]", clock=message['clock'], peer=message['from'])
+                self.token = Token.from_message(message)
+                self.token_requested = False
+                self.try_enter_critical_section()
+                
+            elif msg_type == 'REPLY':
+                # Received reply for one of our requests
+                self.log.info('REPLY', "[Event - REPLY] - [Clock - {clock}] - [Received from Client {peer}]", clock=message['clock'], peer=message['from'], rid=message['rid'])
+                request = self.requests.get(message['rid'])
+                if request is not None:
+                    request.replies.add(message['from'])
+                    
+                # Check if we can proceed
+                self.try_enter_critical_section()
+                    
+            elif msg_type == 'INSERT':
+                # Another client is broadcasting insert
+                self.log.info('INSERT', "[Event - INSERT] - [Clock - {clock}] - [Received from Client {peer}]", clock=self.lamport_clock, peer=message['from'], rid=message['rid'])
+                lsn = self.apply_insert(message['perm'], message['grade'])
+                
+                # Send success
+                success = {
+                    'type': 'SUCCESS',
+                    'from': self.client_id,
+                    'clock': self.lamport_clock,
+                    'rid': message['rid']
+                }
+                self.log.info('SUCCESS', "[Event - SUCCESS] - [Clock - {clock}] - [Sent to Client {peer}]", clock=self.lamport_clock, peer=message['from'], rid=message['rid'])
+                self.when_durable(lsn, lambda: self.send_message(message['from'], success))
+                
+            elif msg_type == 'INSERT_BATCH':
+                # Another client is broadcasting a batch, applied as one unit
+                self.log.info('INSERT_BATCH', "[Event - INSERT_BATCH] - [Clock - {clock}] - [Received from Client {peer}]", clock=self.lamport_clock, peer=message['from'], rid=message['rid'])
+                lsn = None
+                for perm, grade in message['entries']:
+                    lsn = self.apply_insert(perm, grade)
+                    
+                # One success for the whole batch
+                success = {
+                    'type': 'SUCCESS',
+                    'from': self.client_id,
+                    'clock': self.lamport_clock,
+                    'rid': message['rid']
+                }
+                self.log.info('SUCCESS', "[Event - SUCCESS] - [Clock - {clock}] - [Sent to Client {peer}]", clock=self.lamport_clock, peer=message['from'], rid=message['rid'])
+                self.when_durable(lsn, lambda: self.send_message(message['from'], success))
+                
+            elif msg_type == 'SUCCESS':
+                # Received success for one of our inserts
+                self.log.info('SUCCESS', "[Event - SUCCESS] - [Clock - {clock}] - [Received from Client {peer}]", clock=message['clock'], peer=message['from'], rid=message['rid'])
+                request = self.requests.get(message['rid'])
+                if request is None:
+                    return
+                request.successes.add(message['from'])
+                
+                # Check if we got all success messages
+                if len(request.successes) == len(self.peers):
+                    self.log.info('ALL_SUCCESS', "Received all success messages: {count}", count=len(self.peers), rid=request.rid)
+                    self.metrics.observe('replication_ms', (time.monotonic() - request.entered_at) * 1000)
+                    self.finish_insert(request)
+                    
+            elif msg_type == 'RELEASE':
+                # Another client is releasing mutual exclusion
+                self.log.info('RELEASE', "[Event - RELEASE] - [Clock - {clock}] - [Received from Client {peer}]", clock=self.lamport_clock, peer=message['from'], rid=message['rid'])
+                # Remove from queues
+                queued = self.peer_requests.pop((message['from'], message['rid']), None)
+                if queued is not None:
+                    timestamp, parts = queued
+                    for part in parts:
+                        self.request_queues[part].remove(message['from'], timestamp)
+                
+                # Our requests may now be at the head of their queues
+                self.try_enter_critical_section()
+                
+            elif msg_type == 'WELCOME':
+                # A peer has dialed us again after we restarted: its clock and queued requests
+                self.lamport_clock = max(self.lamport_clock, message['clock']) + 1
+                self.log.info('WELCOME', "[Event - WELCOME] - [Clock - {clock}] - [Received from Client {peer}]", clock=message['clock'], peer=message['from'])
+                for rid, timestamp, parts in message['requests']:
+                    if (message['from'], rid) not in self.peer_requests:
+                        for part in parts:
+                            self.request_queues[part].push(timestamp, message['from'])
+                        self.peer_requests[(message['from'], rid)] = (timestamp, parts)
+                if self.rejoining and message['from'] in self.welcomes_missing:
+                    self.welcomes_missing.discard(message['from'])
+                    self.start_join()
+                    
+            elif msg_type == 'SYNC_REQUEST':
+                # A rejoining peer holds every partition, so nothing can change our dictionary under it
+                self.log.info('SYNC_REQUEST', "[Event - SYNC_REQUEST] - [Clock - {clock}] - [Received from Client {peer}]", clock=message['clock'], peer=message['from'])
+                self.send_message(message['from'], {
+                    'type': 'SYNC',
+                    'from': self.client_id,
+                    'entries': self.dictionary.entries(),
+                    'version': self.dictionary.version,
+                    'clock': self.lamport_clock,
+                    'rid': message['rid']
+                })
+                
+            elif msg_type == 'SYNC':
+                # The dictionary we asked for while rejoining replaces whatever we recovered
+                request = self.active.get(message['rid'])
+                if request is None:
+                    return
+                self.dictionary.load(message['entries'], message['version'])
+                if self.wal is not None:
+                    self.wal.snapshot(self.dictionary)
+                self.log.info('SYNC', "copied {count} entries (version {version}) from Client {peer}",
+                              count=len(message['entries']), version=message['version'], peer=message['from'])
+                self.finish_insert(request)
+                
+    def send_dictionary_since(self, conn, version, req_id, chunk_size):
+        """Stream the entries written after version as DICTIONARY_CHUNK messages"""
+        reset = version > self.dictionary.version
+        if reset:
+            # The master's version is from an earlier life of this node; start over
+            version = 0
+        changes = self.dictionary.changes_since(version)
+        chunk_size = max(1, chunk_size)
+        for start in range(0, max(len(changes), 1), chunk_size):
+            chunk = {
+                'type': 'DICTIONARY_CHUNK',
+                'entries': changes[start:start + chunk_size],
+                'version': self.dictionary.version,
+                'reset': reset,
+                'last': start + chunk_size >= len(changes),
+                'clock': self.lamport_clock,
+                'req_id': req_id
+            }
+            self.write_message(conn, chunk)
+            
+    def send_reply(self, recipient_id, rid):
+        """Grant a peer's request"""
+        reply = {
+            'type': 'REPLY',
+            'from': self.client_id,
+            'clock': self.lamport_clock,
+            'rid': rid
+        }
+        self.log.info('REPLY', "[Event - REPLY] - [Clock - {clock}] - [Sent to Client {peer}]", clock=self.lamport_clock, peer=recipient_id, rid=rid)
+        self.send_message(recipient_id, reply)
+        
+    def request_token(self):
+        """Broadcast a TOKEN_REQUEST unless one is already outstanding"""
+        if self.token_requested:
+            return
+        self.token_requested = True
+        self.lamport_clock += 1
+        self.request_numbers[self.client_id] += 1
+        message = {
+            'type': 'TOKEN_REQUEST',
+            'from': self.client_id,
+            'clock': self.lamport_clock,
+            'number': self.request_numbers[self.client_id]
+        }
+        self.log.info('BROADCAST_TOKEN_REQUEST', "[Event - Broadcast - TOKEN_REQUEST] - [Clock - {clock}] - [Sent from Client {client}]", clock=self.lamport_clock, client=self.client_id, number=message['number'])
+        for other_id in self.peers:
+            self.send_message(other_id, message)
+            
+    def pass_token(self, recipient_id):
+        """Send the token to another client"""
+        token, self.token = self.token, None
+        self.lamport_clock += 1
+        self.log.info('TOKEN', "[Event - TOKEN] - [Clock - {clock}] - [Sent to Client {peer}]", clock=self.lamport_clock, peer=recipient_id)
+        self.send_message(recipient_id, token.to_message(self.client_id, self.lamport_clock))
+        
+    def release_token(self):
+        """Suzuki-Kasami release: queue every outstanding requester and pass the token to the first"""
+        token = self.token
+        token.granted[self.client_id] = self.request_numbers[self.client_id]
+        for other_id in sorted(self.peers):
+            if other_id not in token.queue and self.request_numbers[other_id] == token.granted[other_id] + 1:
+                token.queue.append(other_id)
+        if token.queue:
+            self.pass_token(token.queue.popleft())
+            if self.requests:
+                # Get back in line for the rest of our inserts
+                self.request_token()
+                
+    def try_enter_critical_section(self):
+        """Enter the critical section with each of our requests that every peer has granted"""
+        if self.mutex == MUTEX_TOKEN:
+            # Holding the token is the whole permission; our inserts go through it one at a time
+            request = next(iter(self.requests.values()), None)
+            if self.token is not None and not self.active and request is not None:
+                self.execute_insert(request)
+            return
+        if self.mutex == MUTEX_RICART_AGRAWALA:
+            request = next(iter(self.requests.values()), None)
+            if not self.active and request is not None and len(request.replies) == len(self.peers):
+                self.execute_insert(request)
+            return
+        
+        # A request may enter once it heads the queue of every partition it locks
+        for queue in self.request_queues:
+            head = queue.head()
+            if head is None or head[1] != self.client_id:
+                continue
+            request = self.requests.get(self.request_clocks.get(head[0]))
+            if request is None or request.rid in self.active or len(request.replies) < len(self.peers):
+                continue
+            if all(self.request_queues[part].head() == head for part in request.parts):
+                self.execute_insert(request)
+            
+    def check_insert(self, entries, req_id, master):
+        """Refuse an insert the store cannot hold before it takes the lock; True if it may go ahead"""
+        rejected = [perm for perm, grade in entries if not self.dictionary.accepts(perm)]
+        if not rejected:
+            return True
+        self.log.warning('INSERT_REJECTED', "cannot store perms {perms}, insert refused", perms=' '.join(rejected))
+        response = {
+            'type': 'INSERT_ERROR',
+            'error': f"perms the store cannot hold: {' '.join(rejected)}",
+            'clock': self.lamport_clock,
+            'req_id': req_id
+        }
+        self.notify_master(master, response)
+        return False
+        
+    def start_insert(self, entries, req_id=None, master=None, batch=False):
+        """Start insert operation for a list of (perm, grade) entries"""
+        if batch:
+            self.log.info('BATCH_INSERT_REQUEST', "[Event - Master - BATCH_INSERT_REQUEST] - [Clock - {clock}] - [Received from Master]", clock=self.lamport_clock)
+        else:
+            self.log.info('INSERT_REQUEST', "[Event - Master - INSERT_REQUEST] - [Clock - {clock}] - [Received from Master]", clock=self.lamport_clock)
+        self.next_rid += 1
+        request = InsertRequest(self.next_rid, entries, batch, req_id, master)
+        if self.mutex == MUTEX_TOKEN:
+            request.requested_at = time.monotonic()
+            self.requests[request.rid] = request
+            if self.token is None:
+                self.request_token()
+            self.try_enter_critical_section()
+            return
+        if self.mutex == MUTEX_RICART_AGRAWALA and (self.requests or self.backlog):
+            # Deferral compares against a single outstanding request, so run ours one at a time
+            self.backlog.append(request)
+            return
+        self.send_request(request)
+        
+    def send_request(self, request):
+        """Timestamp a request, queue it and broadcast REQUEST"""
+        self.lamport_clock += 1
+        self.log.info('CLOCK', "Clock Value {old} -> {new}", old=self.lamport_clock - 1, new=self.lamport_clock)
+        
+        # Add our request to queue
+        request.clock = self.lamport_clock
+        request.requested_at = time.monotonic()
+        self.requests[request.rid] = request
+        request.replies.update(self.down)  # Peers that are down cannot answer
+        if self.mutex == MUTEX_LAMPORT:
+            if request.join:
+                request.parts = list(range(self.partitions.count))
+            else:
+                # Always at least one partition: a request that locks nothing would never head a queue
+                request.parts = sorted({self.partitions.part(perm) for perm, grade in request.entries}) or [0]
+            for part in request.parts:
+                self.request_queues[part].push(request.clock, self.client_id)
+            self.request_clocks[request.clock] = request.rid
+        
+        # Broadcast request
+        message = {
+            'type': 'REQUEST',
+            'from': self.client_id,
+            'clock': request.clock,
+            'rid': request.rid
+        }
+        if self.partitions.count > 1:
+            # Peers queue exactly the partitions we queued ourselves; with one
+            # partition that is always [0], and leaving it out keeps the
+            # request on the compact binary frame
+            message['parts'] = request.parts
+        self.log.info('BROADCAST_REQUEST', "[Event - Broadcast - REQUEST] - [Clock - {clock}] - [Sent from Client {client}]", clock=self.lamport_clock, client=self.client_id, rid=request.rid)
+        for other_id in self.peers:
+            self.send_message(other_id, message)
+            
+        # With no peers there is nobody to wait for
+        self.try_enter_critical_section()
+        
+    def execute_insert(self, request):
+        """Execute the insert operation"""
+        self.active[request.rid] = request
+        self.in_critical_section = True
+        request.entered_at = time.monotonic()
+        self.metrics.observe('mutex_wait_ms', (request.entered_at - request.requested_at) * 1000)
+        self.metrics.inc('inserts', len(request.entries))
+        
+        if request.join:
+            # Nothing to insert: copy the dictionary of a peer that stayed up
+            self.request_sync(request)
+            return
+        request.successes.update(self.down)  # Peers that are down catch up when they rejoin
+        
+        # Insert locally
+        for perm, grade in request.entries:
+            request.lsn = self.apply_insert(perm, grade)
+            
+        if request.batch:
+            # Replicate the whole batch as one message
+            batch_msg = {
+                'type': 'INSERT_BATCH',
+                'from': self.client_id,
+                'entries': request.entries,
+                'clock': self.lamport_clock,
+                'rid': request.rid
+            }
+            self.log.info('BROADCAST_INSERT_BATCH', "[Event - Broadcast - INSERT_BATCH] - [Clock - {clock}] - [Sent from Client {client}]", clock=self.lamport_clock, client=self.client_id, rid=request.rid)
+            for other_id in self.peers:
+                self.send_message(other_id, batch_msg)
+        else:
+            # Broadcast insert to other clients
+            perm, grade = request.entries[0]
+            insert_msg = {
+                'type': 'INSERT',
+                'from': self.client_id,
+                'perm': perm,
+                'grade': grade,
+                'clock': self.lamport_clock,
+                'rid': request.rid
+            }
+            self.log.info('BROADCAST_INSERT', "[Event - Broadcast - INSERT] - [Clock - {clock}] - [Sent from Client {client}]", clock=self.lamport_clock, client=self.client_id, rid=request.rid)
+            for other_id in self.peers:
+                self.send_message(other_id, insert_msg)
+                
+        # With no peers up there is nobody to wait for
+        if len(request.successes) == len(self.peers):
+            self.finish_insert(request)
+            
+    def request_sync(self, request):
+        """Ask the lowest live peer for its dictionary; with none left there is nothing to copy"""
+        live = sorted(set(self.peers) - self.down)
+        if not live:
+            self.finish_insert(request)
+            return
+        self.send_message(live[0], {
+            'type': 'SYNC_REQUEST',
+            'from': self.client_id,
+            'clock': self.lamport_clock,
+            'rid': request.rid
+        })
+        
+    def finish_insert(self, request):
+        """Finish insert and release mutual exclusion"""
+        del self.active[request.rid]
+        self.in_critical_section = bool(self.active)
+        del self.requests[request.rid]
+        if self.mutex == MUTEX_RICART_AGRAWALA:
+            # Answering the deferred requests is the release
+            deferred, self.deferred_replies = self.deferred_replies, []
+            for other_id, rid in deferred:
+                self.send_reply(other_id, rid)
+        elif self.mutex == MUTEX_TOKEN:
+            self.release_token()
+        else:
+            # Remove ourselves from queues
+            for part in request.parts:
+                self.request_queues[part].remove(self.client_id, request.clock)
+            del self.request_clocks[request.clock]
+            
+            # Broadcast release
+            release = {
+                'type': 'RELEASE',
+                'from': self.client_id,
+                'clock': self.lamport_clock,
+                'rid': request.rid
+            }
+            self.log.info('BROADCAST_RELEASE', "[Event - Broadcast - RELEASE] - [Clock - {clock}] - [Sent from Client {client}]", clock=self.lamport_clock, client=self.client_id, rid=request.rid)
+            for other_id in self.peers:
+                self.send_message(other_id, release)
+                
+        if request.join:
+            # Caught up with the cluster; the master may use us again
+            self.rejoining = False
+            self.log.info('REJOINED', "rejoined the cluster")
+            self.mark_ready()
+        else:
+            # Notify master once our own copy is durable
+            response = self.insert_response(request)
+            self.when_durable(request.lsn, lambda: self.call_later(self.network.release_delay,
+                                                                   lambda: self.notify_master(request.master, response)))
+        
+        # Move on to our next insert
+        if self.backlog:
+            self.send_request(self.backlog.popleft())
+        else:
+            self.try_enter_critical_section()
+            
+    def insert_response(self, request):
+        """The master's answer to a finished insert"""
+        if request.batch:
+            return {
+                'type': 'BATCH_INSERT_SUCCESS',
+                'count': len(request.entries),
+                'clock': self.lamport_clock,
+                'req_id': request.req_id
+            }
+        return {
+            'type': 'INSERT_SUCCESS',
+            'perm': request.entries[0][0],
+            'grade': request.entries[0][1],
+            'clock': self.lamport_clock,
+            'req_id': request.req_id
+        }
+        
+    def notify_master(self, conn, response):
+        """Report a finished insert to the master that requested it"""
+        self.log.info('MASTER_RESPONSE', "[Event - Master - {response}] - [Clock - {clock}] - [Sent to Master]", response=response['type'], clock=response['clock'])
+        try:
+            if conn:
+                self.write_message(conn, response)
+        except Exception as e:
+            self.log.error('SEND_ERROR', "error sending to master: {error}", error=e)
+        
+    def run(self):
+        """Run the client"""
+        self.network.scheduler = TimerWheel(on_error=self.background_failed)
+        
+        # Start server thread
+        threading.Thread(target=self.start_server, daemon=True).start()
+        
+        # Connect to other clients
+        self.connect_to_clients()
+        
+        # Keep running
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.log.info('SHUTDOWN', "shutting down")
+
+class AsyncClient(Client):
+    """Client running every connection and timer on a single asyncio event loop"""
+    def __init__(self, client_id, port, peers, wire_format=wire.FORMAT_JSON, network_config=None,
+                 mutex=MUTEX_LAMPORT, host=DEFAULT_HOST, datadir=None, snapshot_every=50000,
+                 store=STORE_DICT, log=None, coalesce=0.0, partitions=None, rejoin=False):
+        super().__init__(client_id, port, peers, wire_format, network_config, mutex, host,
+                         datadir, snapshot_every, store, log, coalesce, partitions, rejoin)
+        self.loop = None
+        self.unflushed = {}  # writer -> messages written during this loop iteration
+        self.tasks = set()  # Peer watchers and redials, referenced until they finish
+        
+    def write_message(self, conn, message):
+        """Buffer one message for a stream writer until the end of this loop iteration"""
+        data = wire.encode(message, self.wire_formats.get(conn, wire.FORMAT_JSON))
+        pending = self.unflushed.get(conn)
+        if pending is None:
+            if not self.unflushed:
+                self.loop.call_soon(self.flush_writes)
+            pending = self.unflushed[conn] = []
+        pending.append(data)
+        
+    def flush_writes(self):
+        """Write everything produced in one loop iteration with a single write per stream"""
+        unflushed, self.unflushed = self.unflushed, {}
+        for conn, chunks in unflushed.items():
+            if conn.is_closing():
+                continue
+            data = b''.join(chunks)
+            conn.write(data)
+            self.count_write(len(data), len(chunks))
+        
+    def run_threadsafe(self, callback):
+        """Hand callback from another thread to the event loop"""
+        self.loop.call_soon_threadsafe(callback)
+        
+    async def handle_stream(self, reader, writer):
+        """Handle incoming messages on one peer or master stream"""
+        frames = wire.FrameReader()
+        while True:
+            try:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                self.metrics.inc('bytes_received', len(data))
+                frames.feed(data)
+                for message in frames:
+                    if message.get('type') == 'WIRE_HELLO':
+                        self.accept_wire_hello(writer, frames, message)
+                        continue
+                    if message.get('type') == 'HELLO':
+                        self.accept_hello(writer)
+                        continue
+                    self.deliver(message, writer)
+            except Exception as e:
+                self.log.error('CONNECTION_ERROR', "error handling connection: {error}", error=e)
+                break
+        self.wire_formats.pop(writer, None)
+        writer.close()
+        
+    async def connect_to_client(self, other_id, other_host, other_port):
+        """Connect to one other client, retrying with backoff until it is up"""
+        for delay in backoff():
+            try:
+                reader, writer = await asyncio.open_connection(other_host, other_port, limit=STREAM_LIMIT)
+                self.wire_formats[writer] = await wire.negotiate_stream(reader, writer, self.wire_offer)
+            except OSError:
+                await asyncio.sleep(delay)
+                continue
+            self.log.info('CONNECTED', "connected to Client {peer}", peer=other_id)
+            self.link_up(other_id, writer)
+            self.spawn(self.watch_peer(other_id, reader, writer))
+            return
+            
+    async def watch_peer(self, other_id, reader, writer):
+        """Wait on a link we dialed until it closes; peers never write on it, so that means the peer is gone"""
+        try:
+            while await reader.read(4096):
+                pass
+        except OSError:
+            pass
+        self.peer_lost(other_id, writer)
+        
+    def redial(self, other_id):
+        """Dial a peer that went down until it is back"""
+        other_host, other_port = self.peers[other_id]
+        self.spawn(self.connect_to_client(other_id, other_host, other_port))
+        
+    def spawn(self, coroutine):
+        """Run a coroutine as a task on the loop"""
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+                
+    async def serve(self):
+        """Start the server and peer connections on the running loop"""
+        self.loop = asyncio.get_running_loop()
+        self.network.scheduler = self.loop  # Delays become loop timers
+        server = await asyncio.start_server(self.handle_stream, self.host, self.port,
+                                            reuse_address=True, limit=STREAM_LIMIT)
+        self.log.info('LISTENING', "listening on port {port}", port=self.port)
+        
+        await asyncio.gather(*(self.connect_to_client(other_id, other_host, other_port)
+                               for other_id, (other_host, other_port) in self.peers.items()))
+        self.links_ready()
+        async with server:
+            await server.serve_forever()
+            
+    def run(self):
+        """Run the client"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            self.log.info('SHUTDOWN', "shutting down")
+
+def main():
+    """Start one client of the cluster"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-port', type=int, default=None,
+                        help='Listening port (required unless -cluster or -nodes is given)')
+    parser.add_argument('-client', type=int, required=True)
+    parser.add_argument('-cluster', type=str, default=None,
+                        help='JSON membership file: {"clients": {"1": "host:port", ...}}')
+    parser.add_argument('-nodes', type=str, default=None,
+                        help='Membership list: 1=host:port,2=host:port,...')
+    parser.add_argument('-runtime', choices=['thread', 'asyncio'], default='thread',
+                        help='Thread per connection, or a single asyncio event loop')
+    parser.add_argument('-wire', choices=['json', 'binary'], default='json',
+                        help='Offer the length-prefixed binary framing to peers (falls back to JSON)')
+    parser.add_argument('-netdelay', type=str, default=None,
+                        help='JSON file with per-link / per-message delay profiles')
+    parser.add_argument('-mutex', choices=[MUTEX_LAMPORT, MUTEX_RICART_AGRAWALA, MUTEX_TOKEN], default=MUTEX_LAMPORT,
+                        help='Mutual exclusion algorithm (every client must use the same one)')
+    parser.add_argument('-datadir', type=str, default=None,
+                        help='Directory for the write-ahead log and snapshots (in memory only if omitted)')
+    parser.add_argument('-snapshotevery', type=int, default=50000,
+                        help='Write a compacted snapshot after this many logged inserts')
+    parser.add_argument('-store', choices=[STORE_DICT, STORE_COMPACT], default=STORE_DICT,
+                        help='Dictionary storage: Python dict, or compact arrays (integer perms only)')
+    parser.add_argument('-statsport', type=int, default=None,
+                        help='Serve metrics as JSON on http://host:statsport/metrics')
+    parser.add_argument('-loglevel', choices=list(LEVELS), default='info',
+                        help='Events below this level are not logged')
+    parser.add_argument('-logformat', choices=['text', 'json'], default='text',
+                        help='text keeps the original event lines; json writes one object per event')
+    parser.add_argument('-coalesce', type=float, default=0.0,
+                        help='Milliseconds each connection writer waits to batch more messages into one write '
+                             '(0 = only batch what is already queued)')
+    parser.add_argument('-partitions', type=str, default='1',
+                        help="Lock partitions: a count or 'hash:N' to hash perms, or 'range:B1,B2,...' "
+                             "to split integer perms at those bounds (Lamport only; all clients must agree)")
+    parser.add_argument('-rejoin', action='store_true',
+                        help='Restarted after a crash: copy the dictionary from a live peer before taking commands '
+                             '(Lamport or Ricart-Agrawala only)')
+    args = parser.parse_args()
+    try:
+        partitions = parse_partitions(args.partitions)
+    except ValueError as e:
+        parser.error(f'bad -partitions: {e}')
+    if partitions.count > 1 and args.mutex != MUTEX_LAMPORT:
+        parser.error('-partitions needs -mutex lamport')
+    if args.rejoin and args.mutex == MUTEX_TOKEN:
+        parser.error('-rejoin needs -mutex lamport or ricart: a token held by the crashed client is lost')
+    
+    # Cluster membership; without one, the original three clients on consecutive ports
+    members = resolve_cluster(args.cluster, args.nodes)
+    if members is None:
+        if args.port is None:
+            parser.error('-port is required without -cluster or -nodes')
+        members = default_cluster(args.port - args.client + 1)
+    if args.client not in members:
+        parser.error(f'client {args.client} is not in the cluster membership')
+    host, port = members[args.client]
+    if args.port is not None:
+        port = args.port
+    peers = {other_id: address for other_id, address in members.items() if other_id != args.client}
+    
+    if args.runtime == 'asyncio':
+        client_class = AsyncClient
+    else:
+        client_class = Client
+    wire_format = wire.FORMAT_BINARY if args.wire == 'binary' else wire.FORMAT_JSON
+    network_config = None
+    if args.netdelay:
+        with open(args.netdelay, 'r') as f:
+            network_config = json.load(f)
+    client = client_class(args.client, port, peers, wire_format, network_config, args.mutex, host,
+                          args.datadir, args.snapshotevery, args.store,
+                          make_log(f"client{args.client}", f"Client {args.client}", args.loglevel, args.logformat),
+                          args.coalesce / 1000, partitions, args.rejoin)
+    if args.statsport:
+        serve_stats(client.metrics, args.statsport, host)
+        client.log.info('METRICS', "metrics on http://{host}:{port}/metrics", host=host, port=args.statsport)
+    client.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import json
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_SIZE = 3
+
+# Connection retries while the cluster is starting: exponential from a few ms
+CONNECT_BACKOFF_MIN = 0.005
+CONNECT_BACKOFF_MAX = 0.5
+
+def parse_address(address):
+    """Parse 'host:port' (or just 'port') into (host, port)"""
+    address = str(address)
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return DEFAULT_HOST, int(address)
+
+def parse_nodes(spec):
+    """Parse '1=127.0.0.1:8001,2=127.0.0.1:8002,...' into {client_id: (host, port)}"""
+    nodes = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        client_id, address = item.split('=', 1)
+        nodes[int(client_id)] = parse_address(address.strip())
+    return nodes
+
+def load_cluster(path):
+    """Load {client_id: (host, port)} from a cluster membership file.
+
+    The file is JSON: {"clients": {"1": "127.0.0.1:8001", "2": "127.0.0.1:8002"}}
+    """
+    with open(path, 'r') as f:
+        config = json.load(f)
+    return {int(client_id): parse_address(address) for client_id, address in config['clients'].items()}
+
+def default_cluster(base_port, size=DEFAULT_SIZE):
+    """The original layout: clients 1..size on consecutive ports from base_port"""
+    return {client_id: (DEFAULT_HOST, base_port + client_id - 1) for client_id in range(1, size + 1)}
+
+def resolve_cluster(cluster_file=None, nodes=None):
+    """Membership from a -cluster file or a -nodes list, or None if neither was given"""
+    if cluster_file:
+        return load_cluster(cluster_file)
+    if nodes:
+        return parse_nodes(nodes)
+    return None
+
+def backoff(initial=CONNECT_BACKOFF_MIN, maximum=CONNECT_BACKOFF_MAX):
+    """Yield retry delays doubling from initial up to maximum"""
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * 2, maximum)
+
+def write_cluster(path, members):
+    """Write a cluster membership file"""
+    with open(path, 'w') as f:
+        json.dump({'clients': {str(client_id): f"{host}:{port}" for client_id, (host, port) in sorted(members.items())}},
+                  f, indent=2)
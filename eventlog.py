@@ -0,0 +1,111 @@
+import threading
+import atexit
+import queue
+import json
+import time
+import sys
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR, 'off': OFF}
+LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
+
+QUEUE_CAPACITY = 1 << 16  # Events buffered before new ones are dropped
+WRITE_BATCH = 512  # Events formatted and written per write call
+
+class TextFormatter:
+    """The original print format: '<prefix> <message>'"""
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def format(self, timestamp, level, event, template, fields):
+        return f"{self.prefix} {template.format(**fields)}"
+
+class JsonFormatter:
+    """One JSON object per line with the event name and its raw fields"""
+    def __init__(self, node):
+        self.node = node
+
+    def format(self, timestamp, level, event, template, fields):
+        record = {'ts': round(timestamp, 6), 'node': self.node, 'level': LEVEL_NAMES.get(level, level), 'event': event}
+        record.update(fields)
+        return json.dumps(record, default=str)
+
+class EventLog:
+    """Structured event logger that keeps formatting and I/O off the caller's thread.
+
+    log() only checks the level and enqueues the template and field values;
+    a background writer formats events in batches and writes them out. Events
+    below the level cost one comparison. If the queue is full, events are
+    dropped and counted instead of blocking the caller.
+    """
+    def __init__(self, formatter, level=INFO, stream=None, capacity=QUEUE_CAPACITY):
+        self.formatter = formatter
+        self.level = level
+        self.stream = stream or sys.stdout
+        self.queue = queue.Queue(capacity)
+        self.dropped = 0
+        threading.Thread(target=self.run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, event, template, **fields):
+        """Queue an event; template is a str.format pattern over fields"""
+        if level < self.level:
+            return
+        try:
+            self.queue.put_nowait((time.time(), level, event, template, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, event, template, **fields):
+        self.log(DEBUG, event, template, **fields)
+
+    def info(self, event, template, **fields):
+        self.log(INFO, event, template, **fields)
+
+    def warning(self, event, template, **fields):
+        self.log(WARNING, event, template, **fields)
+
+    def error(self, event, template, **fields):
+        self.log(ERROR, event, template, **fields)
+
+    def run(self):
+        """Writer loop: drain the queue in batches"""
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                try:
+                    lines.append(self.formatter.format(*record))
+                except Exception as e:
+                    lines.append(f"Bad log event {record[2]}: {e}")
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(f"Event log queue full: dropped {dropped} events")
+            try:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            except Exception:
+                pass
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait until every queued event has been written"""
+        self.queue.join()
+
+def make_log(node, prefix, level='info', fmt='text', stream=None):
+    """Build an EventLog from command-line style settings"""
+    formatter = JsonFormatter(node) if fmt == 'json' else TextFormatter(prefix)
+    return EventLog(formatter, LEVELS[level], stream)
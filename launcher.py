@@ -0,0 +1,239 @@
+import subprocess
+import argparse
+import signal
+import socket
+import shlex
+import time
+import sys
+import os
+
+import wire
+from cluster import backoff, default_cluster, resolve_cluster
+
+READY_TIMEOUT = 30  # Seconds for every client to answer READY
+STOP_GRACE = 3  # Seconds between each stop signal and the next, harsher one
+POLL_INTERVAL = 0.1
+MAX_RESTARTS = 3  # Per client
+REJOIN_ARGS = ['-rejoin']  # A restarted client catches up from its peers before it takes commands
+
+class Node:
+    """One supervised process"""
+    def __init__(self, name, argv, core=None, log_path=None):
+        self.name = name
+        self.argv = argv
+        self.core = core  # CPU to pin to, or None
+        self.log_path = log_path
+        self.process = None
+        self.log = None
+        self.restarts = 0
+        self.retry = backoff()
+        self.restart_at = None  # When a crashed node is due to be started again
+
+    def start(self, extra_args=()):
+        if self.log_path:
+            if self.log is None:
+                self.log = open(self.log_path, 'a')
+            output = self.log
+        else:
+            output = None
+        # Own session, so a Ctrl-C reaches only the launcher, which then stops everyone in order
+        self.restart_at = None
+        self.process = subprocess.Popen(self.argv + list(extra_args), stdout=output, stderr=subprocess.STDOUT if output else None,
+                                        start_new_session=True)
+        if self.core is not None:
+            try:
+                os.sched_setaffinity(self.process.pid, {self.core})
+            except (AttributeError, OSError) as e:
+                print(f"Launcher: could not pin {self.name} to CPU {self.core}: {e}")
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def send_signal(self, signum):
+        if self.running():
+            try:
+                self.process.send_signal(signum)
+            except OSError:
+                pass
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+def wait_ready(node, address, deadline):
+    """HELLO a client until it answers READY; False if it died or the deadline passed"""
+    for delay in backoff():
+        if not node.running():
+            return False
+        try:
+            with socket.create_connection(address, timeout=max(0.1, deadline - time.time())) as sock:
+                sock.sendall(wire.encode({'type': 'HELLO'}))
+                reader = wire.FrameReader()
+                while True:
+                    data = sock.recv(65536)
+                    if not data:
+                        break
+                    reader.feed(data)
+                    message = reader.next_message()
+                    if message is not None:
+                        if message.get('type') == 'READY':
+                            return True
+                        break
+        except OSError:
+            pass
+        if time.time() + delay > deadline:
+            return False
+        time.sleep(delay)
+
+class Launcher:
+    """Start a local cluster and its master, keep the clients up, and stop everything together.
+
+    Clients start at once and the master only after every client has
+    answered READY. A client that exits while the cluster is running is
+    started again with backoff and -rejoin, so it copies the dictionary from
+    its peers, which redial it, and the master reconnects to it. A client
+    still down after its last restart fails the run. Stopping sends SIGINT,
+    then SIGTERM and finally SIGKILL to whatever is still running.
+    """
+    def __init__(self, members, client_args, master_args, membership_args, cores=None, logdir=None,
+                 max_restarts=MAX_RESTARTS):
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.members = members
+        self.max_restarts = max_restarts
+        cores = list(cores or [])
+        self.clients = {}
+        for index, client_id in enumerate(sorted(members)):
+            argv = [sys.executable, os.path.join(here, 'client.py'), '-client', str(client_id)] + membership_args
+            argv += [arg.replace('{id}', str(client_id)) for arg in client_args]
+            self.clients[client_id] = Node(f"Client {client_id}", argv, cores[index % len(cores)] if cores else None,
+                                           os.path.join(logdir, f"client{client_id}.log") if logdir else None)
+        self.master = None
+        if master_args is not None:
+            self.master = Node('Master', [sys.executable, os.path.join(here, 'master.py')] + membership_args + master_args,
+                               cores[len(members) % len(cores)] if cores else None,
+                               os.path.join(logdir, 'master.log') if logdir else None)
+
+    def run(self):
+        """Bring the cluster up, run the master (or wait for a signal) and shut down; returns an exit status"""
+        try:
+            for node in self.clients.values():
+                node.start()
+            started = time.time()
+            deadline = started + READY_TIMEOUT
+            for client_id, node in sorted(self.clients.items()):
+                if not wait_ready(node, self.members[client_id], deadline):
+                    print(f"Launcher: {node.name} did not become ready")
+                    return 1
+            print(f"Launcher: {len(self.clients)} clients ready in {time.time() - started:.2f} s")
+
+            if self.master is None:
+                # Clients only: supervise until interrupted
+                while self.supervise():
+                    time.sleep(POLL_INTERVAL)
+                return 1
+            self.master.start()
+            while self.master.running():
+                if not self.supervise():
+                    return 1
+                time.sleep(POLL_INTERVAL)
+            status = self.master.process.returncode
+            print(f"Launcher: master exited with status {status}")
+            return status
+        except KeyboardInterrupt:
+            print("Launcher: interrupted")
+            return 130
+        finally:
+            self.shutdown()
+
+    def supervise(self):
+        """Restart clients that have exited; False once one of them is out of restarts"""
+        now = time.time()
+        for node in self.clients.values():
+            if node.running():
+                continue
+            if node.restart_at is None:
+                if node.restarts >= self.max_restarts:
+                    print(f"Launcher: {node.name} exited with status {node.process.returncode} "
+                          f"after {node.restarts} restarts; the run has failed")
+                    return False
+                node.restart_at = now + next(node.retry)
+                print(f"Launcher: {node.name} exited with status {node.process.returncode}, "
+                      f"restarting ({node.restarts + 1}/{self.max_restarts})")
+            elif now >= node.restart_at:
+                node.restarts += 1
+                node.start(REJOIN_ARGS)
+        return True
+
+    def shutdown(self):
+        """Stop every process: SIGINT, then SIGTERM, then SIGKILL"""
+        nodes = ([self.master] if self.master else []) + list(self.clients.values())
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGKILL):
+            for node in nodes:
+                node.send_signal(signum)
+            deadline = time.time() + STOP_GRACE
+            while any(node.running() for node in nodes) and time.time() < deadline:
+                time.sleep(POLL_INTERVAL)
+            if not any(node.running() for node in nodes):
+                break
+        for node in nodes:
+            node.close()
+
+def parse_cores(spec):
+    """CPUs to pin to: 'auto' for every CPU this process may use, or a list like '0,2,4'"""
+    if not spec:
+        return None
+    if spec == 'auto':
+        try:
+            return sorted(os.sched_getaffinity(0))
+        except AttributeError:
+            return list(range(os.cpu_count() or 1))
+    return [int(core) for core in spec.split(',') if core.strip()]
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def main():
+    parser = argparse.ArgumentParser(description='Start a local cluster of clients and a master, and supervise them')
+    parser.add_argument('-clients', type=int, default=3, help='Number of clients (with -baseport)')
+    parser.add_argument('-baseport', type=int, default=8001, help='Port of client 1; the others follow it')
+    parser.add_argument('-cluster', type=str, default=None, help='JSON membership file, instead of -clients/-baseport')
+    parser.add_argument('-nodes', type=str, default=None, help='Membership list: 1=host:port,2=host:port,...')
+    parser.add_argument('-port', type=int, default=None, help='Master port, passed on to the master')
+    parser.add_argument('-inputfile', type=str, default=None, help='Master input; without one only the clients run')
+    parser.add_argument('-outputfile', type=str, default='output.txt')
+    parser.add_argument('-clientargs', type=str, default='',
+                        help="Extra client arguments; {id} becomes the client id, e.g. '-datadir data/{id}'")
+    parser.add_argument('-masterargs', type=str, default='', help='Extra master arguments')
+    parser.add_argument('-pin', type=str, default=None,
+                        help="Pin each process to one CPU, round robin: 'auto' or a list such as 0,2,4")
+    parser.add_argument('-logdir', type=str, default=None, help='Write each process\'s output to a file here')
+    parser.add_argument('-restarts', type=int, default=MAX_RESTARTS,
+                        help='Times each crashed client is restarted (with -rejoin, so not with -mutex token)')
+    args = parser.parse_args()
+
+    members = resolve_cluster(args.cluster, args.nodes)
+    if args.cluster:
+        membership_args = ['-cluster', args.cluster]
+    else:
+        if members is None:
+            members = default_cluster(args.baseport, args.clients)
+        membership_args = ['-nodes', ','.join(f"{client_id}={host}:{port}" for client_id, (host, port) in sorted(members.items()))]
+
+    master_args = None
+    if args.inputfile:
+        master_args = ['-inputfile', args.inputfile, '-outputfile', args.outputfile]
+        if args.port is not None:
+            master_args += ['-port', str(args.port)]
+        master_args += shlex.split(args.masterargs)
+    if args.logdir:
+        os.makedirs(args.logdir, exist_ok=True)
+
+    # make stop (and anything else) sends SIGTERM; shut down as for Ctrl-C
+    signal.signal(signal.SIGTERM, interrupt)
+    launcher = Launcher(members, shlex.split(args.clientargs), master_args, membership_args,
+                        parse_cores(args.pin), args.logdir, args.restarts)
+    sys.exit(launcher.run())
+
+if __name__ == "__main__":
+    main()
@@ -1,162 +1,730 @@
 import socket
 import threading
-import json
 import time
 import argparse
+import random
 import sys
+from collections import deque
+
+import wire
+from netdelay import NetworkEmulator, INSERT_PAUSE
+from cluster import backoff, default_cluster, resolve_cluster
+from metrics import Metrics, serve_stats
+
+RESPONSE_TIMEOUT = 30
+WRITE_COMMANDS = ['insert', 'batch_insert']
+DICTIONARY_COMMANDS = ['dictionary', 'dictionary_since']
+COMMAND_USAGE = {
+    'insert': '<perm> <grade> <client_id>',
+    'batch_insert': '<perm> <grade> [<perm> <grade> ...] <client_id>',
+    'lookup': '<perm> <client_id>',
+    'dictionary': '<client_id>',
+    'dictionary_since': '<version> <client_id>',
+    'wait': '<seconds>'
+}
+OUTPUT_BUFFER = 1 << 16  # Bytes buffered before a streamed write reaches the file
+FLUSH_INTERVAL = 1.0  # Seconds between flushes of streamed output
+
+# Open-loop arrival schedules
+OPEN_LOOP_RATE = 'rate'  # Evenly spaced at a fixed rate
+OPEN_LOOP_POISSON = 'poisson'  # Exponential gaps around a mean rate
+OPEN_LOOP_TIMESTAMPS = 'timestamps'  # Each input line starts with its offset in seconds
+
+def parse_open_loop(spec):
+    """Parse 'rate:N', 'poisson:N[:SEED]' or 'timestamps' into (mode, rate, seed)"""
+    parts = spec.split(':')
+    mode = parts[0]
+    if mode == OPEN_LOOP_TIMESTAMPS and len(parts) == 1:
+        return mode, None, None
+    if mode in (OPEN_LOOP_RATE, OPEN_LOOP_POISSON) and 2 <= len(parts) <= (3 if mode == OPEN_LOOP_POISSON else 2):
+        rate = float(parts[1])
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        return mode, rate, int(parts[2]) if len(parts) == 3 else None
+    raise ValueError(f"expected rate:N, poisson:N[:SEED] or timestamps, not '{spec}'")
 
 class Master:
-    def __init__(self, port, input_file, output_file, client_ports):
+    def __init__(self, port, input_file, output_file, clients, pipeline=0, wire_format=wire.FORMAT_JSON,
+                 insert_pause=INSERT_PAUSE, incremental=False, stream=False, latency_file=None, open_loop=None):
         self.port = port
         self.input_file = input_file
         self.output_file = output_file
-        self.client_ports = client_ports
+        self.clients = clients  # client_id -> (host, port)
         self.client_sockets = {}
         self.output_lines = []
         
+        # Streaming output: results go straight to the file instead of output_lines
+        self.stream = stream
+        self.output = None
+        self.last_flush = 0
+        self.insert_pause = insert_pause  # Pause after each serial insert
+        
+        # Open-loop replay: (mode, rate, seed) from parse_open_loop, or None
+        self.open_loop = open_loop
+        
+        # Per-command latency log: op,client,sent_at,latency_ms,intended_at
+        self.latency_file = latency_file
+        self.latencies = None
+        
+        # Message, byte and command latency metrics, served by -statsport
+        self.metrics = Metrics('master')
+        self.metrics.gauge('unclaimed_responses', lambda: len(self.responses))
+        
+        # Incremental dictionaries: a copy of each client's dictionary kept up
+        # to date with MASTER_DICTIONARY_SINCE instead of full transfers
+        self.incremental = incremental
+        self.dictionary_mirrors = {}  # client_id -> {'version': int, 'grades': dict}
+        self.partial_chunks = {}  # req_id -> entries received so far
+        
+        # Wire format offered to clients, and per-client format and decoder
+        self.wire_offer = wire.SUPPORTED_FORMATS if wire_format == wire.FORMAT_BINARY else [wire.FORMAT_JSON]
+        self.wire_formats = {}
+        self.readers = {}
+        
+        # Pipelined execution: window of in-flight commands (0 = serial)
+        self.pipeline = pipeline
+        self.next_req_id = 0
+        self.responses = {}  # req_id -> response message
+        self.closed_clients = set()
+        self.known_perms = set()  # Perms written by the commands parsed so far
+        self.last_response_at = 0
+        self.response_cond = threading.Condition()
+        
     def connect_to_clients(self):
-        """Connect to all three clients"""
-        time.sleep(3)  # Give clients time to start
-        for client_id in [1, 2, 3]:
-            while True:
-                try:
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    sock.connect(('127.0.0.1', self.client_ports[client_id]))
-                    self.client_sockets[client_id] = sock
-                    print(f"Master connected to Client {client_id}")
-                    break
-                except:
-                    time.sleep(1)
-                    
+        """Connect to every client in parallel and wait until all of them are READY"""
+        threads = [threading.Thread(target=self.connect_to_client, args=(client_id,), daemon=True)
+                   for client_id in sorted(self.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+            
+    def connect_to_client(self, client_id, deadline=None):
+        """Connect to one client with backoff, then HELLO and wait for its READY; False if the deadline passes"""
+        for delay in backoff():
+            if deadline is not None and time.time() > deadline:
+                return False
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.connect(self.clients[client_id])
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.settimeout(RESPONSE_TIMEOUT)  # Only for the handshake; readers block without one
+                self.wire_formats[client_id], self.readers[client_id] = wire.negotiate(sock, self.wire_offer)
+                self.client_sockets[client_id] = sock
+            except OSError:
+                sock.close()
+                time.sleep(delay)
+                continue
+            print(f"Master connected to Client {client_id}")
+            self.send_message(client_id, {'type': 'HELLO'})
+            response = self.receive_message(client_id)
+            if response and response.get('type') == 'READY':
+                print(f"Master [Event - READY] - [Received from Client {client_id}]")
+                return True
+            # Client went away before it was ready; start over
+            self.client_sockets.pop(client_id, None)
+            self.readers.pop(client_id, None)
+            sock.close()
+            time.sleep(delay)
+            
+    def reconnect(self, client_id):
+        """Connect again to a client whose connection closed, e.g. one the launcher restarted"""
+        print(f"Master reconnecting to Client {client_id}")
+        sock = self.client_sockets.pop(client_id, None)
+        if sock is not None:
+            sock.close()
+        self.readers.pop(client_id, None)
+        self.dictionary_mirrors.pop(client_id, None)  # A restarted client numbers its versions afresh
+        if not self.connect_to_client(client_id, time.time() + RESPONSE_TIMEOUT):
+            print(f"Master error: Client {client_id} did not come back")
+            return
+        self.client_sockets[client_id].settimeout(None)
+        with self.response_cond:
+            self.closed_clients.discard(client_id)
+        threading.Thread(target=self.read_responses, args=(client_id,), daemon=True).start()
+        
+    def new_req_id(self):
+        """Allocate a request id for a master command"""
+        self.next_req_id += 1
+        return self.next_req_id
+        
     def send_message(self, client_id, message):
         """Send message to a client"""
         try:
             sock = self.client_sockets.get(client_id)
             if sock:
-                msg = json.dumps(message) + '\n'
-                sock.sendall(msg.encode('utf-8'))
+                data = wire.encode(message, self.wire_formats.get(client_id, wire.FORMAT_JSON))
+                self.metrics.inc('messages_sent', label=message['type'])
+                self.metrics.inc('bytes_sent', len(data))
+                sock.sendall(data)
         except Exception as e:
             print(f"Master error sending to Client {client_id}: {e}")
             
     def receive_message(self, client_id):
-        """Receive message from a client"""
+        """Receive one message from a client during the handshake, before its reader starts"""
         try:
             sock = self.client_sockets.get(client_id)
             if sock:
-                sock.settimeout(30) 
-                buffer = ""
-                while True:
-                    data = sock.recv(4096).decode('utf-8')
-                    if not data:
-                        return None
-                    buffer += data
-                    if '\n' in buffer:
-                        line, buffer = buffer.split('\n', 1)
-                        return json.loads(line)
+                reader = self.readers.setdefault(client_id, wire.FrameReader())
+                message = None
+                while message is None:
+                    message = reader.next_message()
+                    if message is None:
+                        data = sock.recv(65536)
+                        if not data:
+                            return None
+                        self.metrics.inc('bytes_received', len(data))
+                        reader.feed(data)
+                        continue
+                    self.metrics.inc('messages_received', label=message.get('type'))
+                    message = self.merge_chunk(message)
+                return message
         except Exception as e:
             print(f"Master error receiving from Client {client_id}: {e}")
             return None
             
+    def merge_chunk(self, response):
+        """Collect DICTIONARY_CHUNK messages; returns the whole change set after the last one"""
+        if response.get('type') != 'DICTIONARY_CHUNK':
+            return response
+        req_id = response.get('req_id')
+        entries = self.partial_chunks.setdefault(req_id, [])
+        entries.extend(response['entries'])
+        if not response['last']:
+            return None
+        del self.partial_chunks[req_id]
+        return dict(response, entries=entries)
+        
+    def start_readers(self):
+        """Start one response reader thread per client connection"""
+        for client_id, sock in self.client_sockets.items():
+            sock.settimeout(None)  # An idle client is not a dead one; waiters time out instead
+            threading.Thread(target=self.read_responses, args=(client_id,), daemon=True).start()
+            
+    def read_responses(self, client_id):
+        """Route responses from a client to waiting commands by req_id"""
+        sock = self.client_sockets[client_id]
+        reader = self.readers.setdefault(client_id, wire.FrameReader())
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                self.metrics.inc('bytes_received', len(data))
+                reader.feed(data)
+                for response in reader:
+                    self.metrics.inc('messages_received', label=response.get('type'))
+                    with self.response_cond:
+                        response = self.merge_chunk(response)
+                        if response is None:
+                            continue
+                        self.responses[response.get('req_id')] = response
+                        self.last_response_at = time.time()
+                        self.response_cond.notify_all()
+        except Exception as e:
+            print(f"Master error receiving from Client {client_id}: {e}")
+        with self.response_cond:
+            self.closed_clients.add(client_id)
+            self.response_cond.notify_all()
+            
     def process_commands(self):
         """Process commands from input file"""
         try:
-            with open(self.input_file, 'r') as f:
-                commands = f.readlines()
+            f = open(self.input_file, 'r')
         except FileNotFoundError:
             print(f"Error: Input file '{self.input_file}' not found")
             return
             
+        with f:
+            # Lines are read lazily, so the input is never held in memory
+            self.start_readers()
+            if self.open_loop:
+                self.process_commands_open_loop(f)
+            elif self.pipeline > 0:
+                self.process_commands_pipelined(f)
+            else:
+                self.process_commands_serial(f)
+                
+    def process_commands_serial(self, commands):
+        """Run commands one at a time"""
         for command in commands:
             command = command.strip()
             if not command:
                 continue
                 
             print(f"Master processing: {command}")
-            parts = command.split()
+            cmd = self.parse_command(command)
+            if cmd is None:
+                continue
+                
+            if cmd['op'] == 'wait':
+                print(f"Master [Event - WAIT] [TIME - {cmd['time']}]")
+                self.sleep(cmd['time'])
+                continue
+                
+            sent_at = time.time()
+            req_id = self.dispatch(cmd)
+            response = self.await_response(req_id, cmd['client_id'])
+            self.record_latency(cmd['op'], cmd['client_id'], sent_at, response)
+            output_line = self.command_result(cmd, response)
+            if output_line:
+                self.emit(output_line)
+                print(f"OUTPUT: {output_line}")
+                if cmd['op'] in WRITE_COMMANDS:
+                    self.sleep(self.insert_pause)
+                    
+    def parse_command(self, command):
+        """Parse an input line into a command dict; None if the line is unknown or malformed"""
+        parts = command.split()
+        if not parts:
+            return None
+        op, args = parts[0].lower(), parts[1:]
+        if op not in COMMAND_USAGE:
+            return None
+        try:
+            if op == 'batch_insert':
+                # <perm> <grade> pairs, at least one, then the client id
+                if len(args) < 3 or len(args) % 2 == 0:
+                    raise ValueError
+            elif len(args) != len(COMMAND_USAGE[op].split()):
+                raise ValueError
+            if op == 'insert':
+                cmd = {'op': op, 'perm': args[0], 'grade': args[1], 'client_id': int(args[2])}
+            elif op == 'batch_insert':
+                cmd = {'op': op, 'entries': list(zip(args[0:-1:2], args[1:-1:2])), 'client_id': int(args[-1])}
+            elif op == 'lookup':
+                cmd = {'op': op, 'perm': args[0], 'client_id': int(args[1])}
+            elif op == 'dictionary':
+                cmd = {'op': op, 'client_id': int(args[0])}
+            elif op == 'dictionary_since':
+                cmd = {'op': op, 'version': int(args[0]), 'client_id': int(args[1])}
+            else:
+                cmd = {'op': op, 'time': int(args[0])}
+            if 'client_id' in cmd and cmd['client_id'] not in self.clients:
+                raise ValueError  # Nobody would answer: the command would only wait out RESPONSE_TIMEOUT
+        except ValueError:
+            print(f"Master error: skipping malformed command '{command}', expected: {op} {COMMAND_USAGE[op]}")
+            return None
+        if op in WRITE_COMMANDS:
+            # Lines are parsed in input order, so this marks the inserts that add keys in a serial run
+            perms = self.command_perms(cmd)
+            cmd['creates'] = not perms <= self.known_perms
+            self.known_perms |= perms
+        return cmd
+        
+    def process_commands_pipelined(self, commands):
+        """Process commands keeping a window of in-flight requests across clients"""
+        results = {}  # input line index -> output line (None if it had none)
+        order = deque()  # Indexes of dispatched commands not yet written, in input order
+        in_flight = {}  # req_id -> command
+        
+        for index, command in enumerate(commands):
+            command = command.strip()
+            if not command:
+                continue
+                
+            print(f"Master processing: {command}")
+            cmd = self.parse_command(command)
+            if cmd is None:
+                continue
+            cmd['index'] = index
             
-            if parts[0].lower() == 'insert':
-                perm = parts[1]
-                grade = parts[2]
-                client_id = int(parts[3])
-                self.handle_insert(perm, grade, client_id)
+            if cmd['op'] == 'wait':
+                # A wait line orders everything before it against everything after it
+                self.drain(in_flight, results, 0)
+                self.emit_in_order(order, results)
+                print(f"Master [Event - WAIT] [TIME - {cmd['time']}]")
+                self.sleep(cmd['time'])
+                continue
                 
-            elif parts[0].lower() == 'lookup':
-                perm = parts[1]
-                client_id = int(parts[2])
-                self.handle_lookup(perm, client_id)
+            with self.response_cond:
+                while len(in_flight) >= self.pipeline or any(self.conflicts(cmd, other) for other in in_flight.values()):
+                    self.collect_responses(in_flight, results)
+            self.emit_in_order(order, results)
+            
+            cmd['req_id'] = self.dispatch(cmd)
+            cmd['sent_at'] = time.time()
+            in_flight[cmd['req_id']] = cmd
+            order.append(index)
+            
+        self.drain(in_flight, results, 0)
+        self.emit_in_order(order, results)
+        
+    def process_commands_open_loop(self, commands):
+        """Issue commands on their schedule, however fast responses come back.
+
+        A command that conflicts with one in flight, or with an earlier one
+        still held, is held until it no longer does; everything else goes out
+        when due. Latency is measured from when a command was due, so time
+        spent held or behind schedule counts.
+        """
+        results = {}
+        order = deque()
+        in_flight = {}
+        held = []  # Due commands waiting on a conflict, in input order
+        
+        for cmd in self.arrivals(commands, time.time()):
+            self.run_until(cmd['intended_at'], in_flight, held, results, order)
+            held.append(cmd)
+            order.append(cmd['index'])
+            self.release_held(held, in_flight)
+            
+        while in_flight or held:
+            with self.response_cond:
+                self.collect_responses(in_flight, results)
+            self.emit_in_order(order, results)
+            self.release_held(held, in_flight)
+            
+    def arrivals(self, commands, start):
+        """Parse commands and stamp each with the time it is due"""
+        mode, rate, seed = self.open_loop
+        rng = random.Random(seed)
+        offset = 0.0
+        shift = 0.0  # Added by wait lines, which delay the schedule instead of the master
+        for index, command in enumerate(commands):
+            command = command.strip()
+            if not command:
+                continue
+            if mode == OPEN_LOOP_TIMESTAMPS:
+                first, _, rest = command.partition(' ')
+                try:
+                    offset = float(first)
+                    command = rest.strip()
+                except ValueError:
+                    pass  # No timestamp: due with the previous line
+                if not command:
+                    continue  # A timestamp with no command
+                    
+            print(f"Master processing: {command}")
+            cmd = self.parse_command(command)
+            if cmd is None:
+                continue
+            if cmd['op'] == 'wait':
+                print(f"Master [Event - WAIT] [TIME - {cmd['time']}]")
+                shift += cmd['time']
+                continue
+            cmd['index'] = index
+            cmd['intended_at'] = start + shift + offset
+            yield cmd
+            if mode == OPEN_LOOP_RATE:
+                offset += 1 / rate
+            elif mode == OPEN_LOOP_POISSON:
+                offset += rng.expovariate(rate)
+                
+    def run_until(self, deadline, in_flight, held, results, order):
+        """Handle responses and release held commands until deadline"""
+        while True:
+            with self.response_cond:
+                self.collect_responses(in_flight, results, timeout=max(0, min(1, deadline - time.time())))
+            self.emit_in_order(order, results)
+            self.release_held(held, in_flight)
+            if time.time() >= deadline:
+                return
+                
+    def release_held(self, held, in_flight):
+        """Dispatch held commands that conflict with nothing in flight or held before them"""
+        waiting = []
+        for cmd in held:
+            if any(self.conflicts(cmd, other) for other in in_flight.values()) or \
+                    any(self.conflicts(cmd, other) for other in waiting):
+                waiting.append(cmd)
+                continue
+            cmd['req_id'] = self.dispatch(cmd)
+            cmd['sent_at'] = time.time()
+            in_flight[cmd['req_id']] = cmd
+        held[:] = waiting
+        
+    def emit_in_order(self, order, results):
+        """Emit finished results up to the oldest command still in flight"""
+        while order and order[0] in results:
+            output_line = results.pop(order.popleft())
+            if output_line:
+                self.emit(output_line)
+                
+    def emit(self, output_line):
+        """Record one output line, writing it through when streaming"""
+        if self.output is None:
+            self.output_lines.append(output_line)
+            return
+        self.output.write(output_line + '\n')
+        self.flush_output()
+        
+    def flush_output(self, force=False):
+        """Flush streamed output once FLUSH_INTERVAL has passed since the last flush, or at once if forced"""
+        if self.output is None:
+            return
+        now = time.time()
+        if force or now - self.last_flush >= FLUSH_INTERVAL:
+            self.output.flush()
+            self.last_flush = now
+            
+    def sleep(self, seconds):
+        """Sleep, flushing streamed output first so finished results are not left in the buffer"""
+        if seconds > 0:
+            self.flush_output(force=True)
+            time.sleep(seconds)
+            
+    def conflicts(self, cmd, other):
+        """Check whether cmd has to wait for the in-flight command other"""
+        cmd_writes = cmd['op'] in WRITE_COMMANDS
+        other_writes = other['op'] in WRITE_COMMANDS
+        if self.incremental and cmd['op'] == other['op'] == 'dictionary' and cmd['client_id'] == other['client_id']:
+            return True  # Each delta builds on the previous one's version
+        if not cmd_writes and not other_writes:
+            return False  # Reads never conflict with each other
+        if cmd['op'] in DICTIONARY_COMMANDS or other['op'] in DICTIONARY_COMMANDS:
+            return True
+        if cmd_writes and other_writes and cmd['creates'] and other['creates']:
+            return True  # Keys must be created in input order for dictionaries to list them as a serial run does
+        return not self.command_perms(cmd).isdisjoint(self.command_perms(other))
+        
+    def command_perms(self, cmd):
+        """Perms read or written by an insert, batch_insert or lookup command"""
+        if cmd['op'] == 'batch_insert':
+            return {perm for perm, grade in cmd['entries']}
+        return {cmd['perm']}
+        
+    def dispatch(self, cmd):
+        """Send a command to its client and return its req_id"""
+        if cmd['client_id'] in self.closed_clients:
+            self.reconnect(cmd['client_id'])
+        if cmd['op'] == 'insert':
+            return self.send_insert(cmd['perm'], cmd['grade'], cmd['client_id'])
+        elif cmd['op'] == 'batch_insert':
+            return self.send_batch_insert(cmd['entries'], cmd['client_id'])
+        elif cmd['op'] == 'lookup':
+            return self.send_lookup(cmd['perm'], cmd['client_id'])
+        elif cmd['op'] == 'dictionary_since':
+            return self.send_dictionary_since(cmd['version'], cmd['client_id'])
+        return self.send_dictionary(cmd['client_id'])
+        
+    def drain(self, in_flight, results, limit):
+        """Wait until at most limit commands are in flight"""
+        with self.response_cond:
+            while len(in_flight) > limit:
+                self.collect_responses(in_flight, results)
                 
-            elif parts[0].lower() == 'dictionary':
-                client_id = int(parts[1])
-                self.handle_dictionary(client_id)
+    def collect_responses(self, in_flight, results, timeout=1):
+        """Wait for and record completed in-flight commands (caller holds response_cond)"""
+        # Queued inserts can legitimately take long, so only give up on a
+        # command once the whole cluster has been silent for RESPONSE_TIMEOUT
+        idle_since = time.time() - RESPONSE_TIMEOUT
+        done = [req_id for req_id, cmd in in_flight.items()
+                if req_id in self.responses or cmd['client_id'] in self.closed_clients
+                or max(cmd['sent_at'], self.last_response_at) < idle_since]
+        if not done:
+            if timeout > 0:
+                self.flush_output()
+                self.response_cond.wait(timeout=timeout)
+            return
+            
+        for req_id in done:
+            cmd = in_flight.pop(req_id)
+            response = self.responses.pop(req_id, None)
+            self.record_latency(cmd['op'], cmd['client_id'], cmd['sent_at'], response, cmd.get('intended_at'))
+            if response is None:
+                print(f"Master error receiving from Client {cmd['client_id']}: no response for request {req_id}")
+                results[cmd['index']] = None
+                continue
+            output_line = self.command_result(cmd, response)
+            results[cmd['index']] = output_line
+            if output_line:
+                print(f"OUTPUT: {output_line}")
                 
-            elif parts[0].lower() == 'wait':
-                wait_time = int(parts[1])
-                print(f"Master [Event - WAIT] [TIME - {wait_time}]")
-                time.sleep(wait_time)
+    def await_response(self, req_id, client_id):
+        """Wait for the response to one request; None if its client closed or the cluster went quiet"""
+        sent_at = time.time()
+        with self.response_cond:
+            while req_id not in self.responses:
+                if client_id in self.closed_clients:
+                    break
+                if time.time() - max(sent_at, self.last_response_at) > RESPONSE_TIMEOUT:
+                    print(f"Master error receiving from Client {client_id}: no response for request {req_id}")
+                    break
+                self.flush_output()
+                self.response_cond.wait(timeout=1)
+            return self.responses.pop(req_id, None)
+            
+    def command_result(self, cmd, response):
+        """Turn the response to a dispatched command into its output line"""
+        if cmd['op'] == 'insert':
+            return self.insert_result(cmd['perm'], cmd['grade'], cmd['client_id'], response)
+        elif cmd['op'] == 'batch_insert':
+            return self.batch_insert_result(cmd['entries'], cmd['client_id'], response)
+        elif cmd['op'] == 'lookup':
+            return self.lookup_result(cmd['perm'], cmd['client_id'], response)
+        elif cmd['op'] == 'dictionary_since':
+            return self.dictionary_since_result(cmd['client_id'], response)
+        return self.dictionary_result(cmd['client_id'], response)
                 
-    def handle_insert(self, perm, grade, client_id):
-        """Handle insert command"""
+    def send_insert(self, perm, grade, client_id):
+        """Send an insert command to a client"""
         print(f"Master [Event - INSERT] [PERM - {perm}] [GRADE - {grade}] - [Sent to Client {client_id}]")
         
+        req_id = self.new_req_id()
         message = {
             'type': 'MASTER_INSERT',
             'perm': perm,
-            'grade': grade
+            'grade': grade,
+            'req_id': req_id
         }
         self.send_message(client_id, message)
+        return req_id
         
-        # Wait for response
-        response = self.receive_message(client_id)
+    def insert_result(self, perm, grade, client_id, response):
+        """Turn an insert response into an output line"""
         if response and response['type'] == 'INSERT_SUCCESS':
             print(f"Master [Event - INSERT_SUCCESS] - [Clock - {response['clock']}] - [Received from Client {client_id}]")
-            output_line = f"SUCCESS <insert {perm} {grade} {client_id}>"
-            self.output_lines.append(output_line)
-            print(f"OUTPUT: {output_line}")
-            time.sleep(3)
+            return f"SUCCESS <insert {perm} {grade} {client_id}>"
+        if response and response['type'] == 'INSERT_ERROR':
+            print(f"Master [Event - INSERT_ERROR] [{response['error']}] - [Received from Client {client_id}]")
+        return None
 
-    def handle_lookup(self, perm, client_id):
-        """Handle lookup command"""
+    def send_batch_insert(self, entries, client_id):
+        """Send a batch of (perm, grade) inserts to a client"""
+        print(f"Master [Event - BATCH_INSERT] [COUNT - {len(entries)}] - [Sent to Client {client_id}]")
+        
+        req_id = self.new_req_id()
+        message = {
+            'type': 'MASTER_BATCH_INSERT',
+            'entries': [[perm, grade] for perm, grade in entries],
+            'req_id': req_id
+        }
+        self.send_message(client_id, message)
+        return req_id
+        
+    def batch_insert_result(self, entries, client_id, response):
+        """Turn a batch insert response into an output line"""
+        if response and response['type'] == 'BATCH_INSERT_SUCCESS':
+            print(f"Master [Event - BATCH_INSERT_SUCCESS] - [Clock - {response['clock']}] - [Received from Client {client_id}]")
+            pairs = ' '.join(f"{perm} {grade}" for perm, grade in entries)
+            return f"SUCCESS <batch_insert {pairs} {client_id}>"
+        if response and response['type'] == 'INSERT_ERROR':
+            print(f"Master [Event - INSERT_ERROR] [{response['error']}] - [Received from Client {client_id}]")
+        return None
+
+    def send_lookup(self, perm, client_id):
+        """Send a lookup command to a client"""
         print(f"Master [Event - LOOKUP] [PERM - {perm}] - [Sent to Client {client_id}]")
         
+        req_id = self.new_req_id()
         message = {
             'type': 'MASTER_LOOKUP',
-            'perm': perm
+            'perm': perm,
+            'req_id': req_id
         }
         self.send_message(client_id, message)
+        return req_id
         
-        # Wait for response
-        response = self.receive_message(client_id)
+    def lookup_result(self, perm, client_id, response):
+        """Turn a lookup response into an output line"""
         if response and response['type'] == 'LOOKUP_RESULT':
             print(f"Master [Event - LOOKUP_SUCCESS] - [Clock - {response['clock']}] - [Received from Client {client_id}]")
             grade = response['grade']
             if grade == 'NOT FOUND':
-                output_line = f"LOOKUP <{perm}, NOT FOUND>"
-            else:
-                output_line = f"LOOKUP <{perm}, {grade}>"
-            self.output_lines.append(output_line)
-            print(f"OUTPUT: {output_line}")
+                return f"LOOKUP <{perm}, NOT FOUND>"
+            return f"LOOKUP <{perm}, {grade}>"
+        return None
             
-    def handle_dictionary(self, client_id):
-        """Handle dictionary command"""
+    def send_dictionary(self, client_id):
+        """Send a dictionary command to a client"""
         print(f"Master [Event - DICTIONARY] - [Sent to Client {client_id}]")
         
-        message = {
-            'type': 'MASTER_DICTIONARY'
-        }
+        req_id = self.new_req_id()
+        if self.incremental:
+            # Only ask for what changed since our copy
+            mirror = self.dictionary_mirrors.get(client_id)
+            message = {
+                'type': 'MASTER_DICTIONARY_SINCE',
+                'version': mirror['version'] if mirror else 0,
+                'req_id': req_id
+            }
+        else:
+            message = {
+                'type': 'MASTER_DICTIONARY',
+                'req_id': req_id
+            }
         self.send_message(client_id, message)
+        return req_id
         
-        # Wait for response
-        response = self.receive_message(client_id)
+    def dictionary_result(self, client_id, response):
+        """Turn a dictionary response into an output line"""
         if response and response['type'] == 'DICTIONARY_RESULT':
             print(f"Master [Event - DICTIONARY_SUCCESS] - [Clock - {response['clock']}] - [Received from Client {client_id}]")
             dictionary = response['dictionary']
             # Format as dictionary
-            output_line = str(dictionary).replace("'", "'")
-            self.output_lines.append(output_line)
-            print(f"OUTPUT: {output_line}")
+            return str(dictionary).replace("'", "'")
+        if response and response['type'] == 'DICTIONARY_CHUNK':
+            print(f"Master [Event - DICTIONARY_SUCCESS] - [Clock - {response['clock']}] - [Received from Client {client_id}]")
+            return str(self.apply_dictionary_changes(client_id, response))
+        return None
+        
+    def apply_dictionary_changes(self, client_id, response):
+        """Bring our copy of a client's dictionary up to date and return it"""
+        mirror = self.dictionary_mirrors.setdefault(client_id, {'version': 0, 'grades': {}})
+        if response['reset']:
+            mirror['grades'] = {}
+        grades = mirror['grades']
+        new_entries = []
+        for perm, grade, version, created in response['entries']:
+            if perm in grades:
+                grades[perm] = grade
+            else:
+                new_entries.append((created, perm, grade))
+        # New perms were all created after our last sync, so appending them in
+        # creation order keeps the client's own dictionary order
+        for created, perm, grade in sorted(new_entries):
+            grades[perm] = grade
+        mirror['version'] = response['version']
+        return grades
+        
+    def send_dictionary_since(self, version, client_id):
+        """Ask a client for the entries written after version"""
+        print(f"Master [Event - DICTIONARY_SINCE] [VERSION - {version}] - [Sent to Client {client_id}]")
+        
+        req_id = self.new_req_id()
+        message = {
+            'type': 'MASTER_DICTIONARY_SINCE',
+            'version': version,
+            'req_id': req_id
+        }
+        self.send_message(client_id, message)
+        return req_id
+        
+    def dictionary_since_result(self, client_id, response):
+        """Turn a dictionary_since response into an output line"""
+        if response and response['type'] == 'DICTIONARY_CHUNK':
+            print(f"Master [Event - DICTIONARY_SINCE_SUCCESS] - [Clock - {response['clock']}] - [Received from Client {client_id}]")
+            changes = {perm: grade for perm, grade, version, created in response['entries']}
+            return f"DICTIONARY_SINCE <{response['version']}> {changes}"
+        return None
+            
+    def record_latency(self, op, client_id, sent_at, response, intended_at=None):
+        """Record how long a command took from when it was due (when sent, if not scheduled)"""
+        if response is None:
+            return
+        if intended_at is None:
+            intended_at = sent_at
+        else:
+            self.metrics.observe('dispatch_lag_ms', (sent_at - intended_at) * 1000, label=op)
+        latency_ms = (time.time() - intended_at) * 1000
+        self.metrics.observe('command_ms', latency_ms, label=op)
+        if self.latencies is not None:
+            self.latencies.write(f"{op},{client_id},{sent_at:.6f},{latency_ms:.3f},{intended_at:.6f}\n")
             
+    def open_output(self):
+        """Start the output file for streaming"""
+        self.output = open(self.output_file, 'w', buffering=OUTPUT_BUFFER)
+        self.last_flush = time.time()
+        
     def write_output(self):
         """Write output to file"""
+        if self.output is not None:
+            # Streamed lines are already in the file; just flush what is buffered
+            self.output.close()
+            self.output = None
+            print(f"Output written to {self.output_file}")
+            return
         try:
             with open(self.output_file, 'w') as f:
                 for line in self.output_lines:
@@ -169,14 +737,23 @@ class Master:
         """Run the master process"""
         print("Master starting...")
         
+        if self.stream:
+            self.open_output()
+        if self.latency_file:
+            self.latencies = open(self.latency_file, 'w')
+            self.latencies.write("op,client,sent_at,latency_ms,intended_at\n")
+            
         # Connect to clients
         self.connect_to_clients()
         
         # Process commands
-        self.process_commands()
-        
-        # Write output
-        self.write_output()
+        try:
+            self.process_commands()
+        finally:
+            # Write output
+            self.write_output()
+            if self.latencies is not None:
+                self.latencies.close()
         
         print("Master finished processing commands")
         
@@ -189,17 +766,51 @@ class Master:
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('-port', type=int, required=True)
+    parser.add_argument('-port', type=int, default=None,
+                        help='Master port; the clients are assumed on the three ports below it '
+                             'unless -cluster or -nodes is given')
     parser.add_argument('-inputfile', type=str, required=True)
     parser.add_argument('-outputfile', type=str, required=True)
+    parser.add_argument('-pipeline', type=int, default=0,
+                        help='Number of commands kept in flight across clients (0 = serial)')
+    parser.add_argument('-wire', choices=['json', 'binary'], default='json',
+                        help='Offer the length-prefixed binary framing to clients (falls back to JSON)')
+    parser.add_argument('-netdelay', type=str, default=None,
+                        help='JSON delay profile file; its insert_pause replaces the 3 s pause after inserts')
+    parser.add_argument('-cluster', type=str, default=None,
+                        help='JSON membership file: {"clients": {"1": "host:port", ...}}')
+    parser.add_argument('-nodes', type=str, default=None,
+                        help='Membership list: 1=host:port,2=host:port,...')
+    parser.add_argument('-incremental', action='store_true',
+                        help='Fetch dictionary commands as changes since the last version seen from that client')
+    parser.add_argument('-stream', action='store_true',
+                        help='Write each result to the output file as it completes instead of at the end')
+    parser.add_argument('-statsport', type=int, default=None,
+                        help='Serve metrics as JSON on http://127.0.0.1:statsport/metrics')
+    parser.add_argument('-latencyfile', type=str, default=None,
+                        help='CSV file to log every command latency to (op,client,sent_at,latency_ms,intended_at)')
+    parser.add_argument('-openloop', type=str, default=None,
+                        help='Issue commands on a schedule instead of as responses return: rate:N (N per second), '
+                             'poisson:N[:SEED], or timestamps (each line starts with its offset in seconds)')
     args = parser.parse_args()
+    open_loop = None
+    if args.openloop:
+        try:
+            open_loop = parse_open_loop(args.openloop)
+        except ValueError as e:
+            parser.error(f'bad -openloop: {e}')
 
-    base_port = args.port - 3
-    client_ports = {
-        1: base_port,
-        2: base_port + 1,
-        3: base_port + 2
-    }
+    clients = resolve_cluster(args.cluster, args.nodes)
+    if clients is None:
+        if args.port is None:
+            parser.error('-port is required without -cluster or -nodes')
+        clients = default_cluster(args.port - 3)
     
-    master = Master(args.port, args.inputfile, args.outputfile, client_ports)
+    master = Master(args.port, args.inputfile, args.outputfile, clients, args.pipeline,
+                    wire.FORMAT_BINARY if args.wire == 'binary' else wire.FORMAT_JSON,
+                    NetworkEmulator.from_file(args.netdelay).insert_pause, args.incremental,
+                    args.stream, args.latencyfile, open_loop)
+    if args.statsport:
+        serve_stats(master.metrics, args.statsport)
+        print(f"Master metrics on http://127.0.0.1:{args.statsport}/metrics")
     master.run()
\ No newline at end of file
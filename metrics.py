@@ -0,0 +1,177 @@
+import threading
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in ms: 0.05 ms doubling up to ~14 minutes
+BUCKET_BOUNDS = [0.05 * 2 ** i for i in range(25)]
+SUMMARY_PERCENTILES = [50, 95, 99]
+
+class Histogram:
+    """Latency histogram with exponential buckets.
+
+    Percentiles are estimated as the upper bound of the bucket they fall in,
+    so they are accurate to within a factor of two.
+    """
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)  # Last bucket is overflow
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """Record one value"""
+        index = 0
+        while index < len(BUCKET_BOUNDS) and value > BUCKET_BOUNDS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, pct):
+        """Estimated value below which pct percent of observations fall"""
+        if not self.count:
+            return None
+        rank = pct * self.count / 100
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(BUCKET_BOUNDS[index], self.max) if index < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def snapshot(self):
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'buckets': {f"{BUCKET_BOUNDS[index]:g}" if index < len(BUCKET_BOUNDS) else 'inf': count
+                        for index, count in enumerate(self.buckets) if count}
+        }
+        for pct in SUMMARY_PERCENTILES:
+            summary[f"p{pct}"] = self.percentile(pct)
+        return summary
+
+class Metrics:
+    """In-process counters, gauges and histograms for one node.
+
+    Counters and histograms take an optional label (such as a message type);
+    gauges are callables read when a snapshot is taken.
+    """
+    def __init__(self, node):
+        self.node = node
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counters = {}  # name -> value, or name -> {label: value}
+        self.histograms = {}  # name -> Histogram, or name -> {label: Histogram}
+        self.gauges = {}  # name -> callable
+
+    def inc(self, name, amount=1, label=None):
+        """Add amount to a counter"""
+        with self.lock:
+            if label is None:
+                self.counters[name] = self.counters.get(name, 0) + amount
+            else:
+                values = self.counters.setdefault(name, {})
+                values[label] = values.get(label, 0) + amount
+
+    def observe(self, name, value, label=None):
+        """Record a value in a histogram"""
+        with self.lock:
+            if label is None:
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = Histogram()
+            else:
+                histograms = self.histograms.setdefault(name, {})
+                histogram = histograms.get(label)
+                if histogram is None:
+                    histogram = histograms[label] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, read):
+        """Register a gauge read by calling read()"""
+        self.gauges[name] = read
+
+    def counter(self, name):
+        """Copy of one counter (a number, or a dict of labelled values)"""
+        with self.lock:
+            value = self.counters.get(name, {})
+            return dict(value) if isinstance(value, dict) else value
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict"""
+        with self.lock:
+            counters = {name: dict(value) if isinstance(value, dict) else value
+                        for name, value in self.counters.items()}
+            histograms = {}
+            for name, value in self.histograms.items():
+                if isinstance(value, dict):
+                    histograms[name] = {label: histogram.snapshot() for label, histogram in value.items()}
+                else:
+                    histograms[name] = value.snapshot()
+        gauges = {}
+        for name, read in self.gauges.items():
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                gauges[name] = f"error: {e}"
+        return {
+            'node': self.node,
+            'uptime_s': time.time() - self.started,
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': histograms
+        }
+
+class TimedLock:
+    """threading.Lock that records how long it is held in a histogram"""
+    def __init__(self, metrics, name):
+        self.lock = threading.Lock()
+        self.metrics = metrics
+        self.name = name
+        self.acquired_at = 0
+
+    def acquire(self, *args, **kwargs):
+        acquired = self.lock.acquire(*args, **kwargs)
+        if acquired:
+            self.acquired_at = time.perf_counter()
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self.acquired_at
+        self.lock.release()
+        self.metrics.observe(self.name, held * 1000)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def serve_stats(metrics, port, host='127.0.0.1'):
+    """Serve metrics.snapshot() as JSON over HTTP (GET /metrics) from a background thread"""
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = json.dumps(metrics.snapshot(), indent=2, sort_keys=True).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the event log
+
+    server = ThreadingHTTPServer((host, port), StatsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
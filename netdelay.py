@@ -0,0 +1,215 @@
+import threading
+import math
+import random
+import json
+import time
+from collections import deque
+
+# Delays used when no profile says otherwise (the original lab timings)
+NETWORK_DELAY = 3
+RELEASE_DELAY = 6
+INSERT_PAUSE = 3
+
+DEFAULT_CONFIG = {
+    'default': {'dist': 'fixed', 'delay': NETWORK_DELAY},
+    'master': {'dist': 'fixed', 'delay': 0},
+    'release_delay': RELEASE_DELAY,
+    'insert_pause': INSERT_PAUSE
+}
+
+class TimerWheel:
+    """Hashed timer wheel run by one background thread.
+
+    Timers are bucketed by tick into a fixed ring of slots, so scheduling is
+    O(1). Callbacks due on the same tick run in the order they were scheduled.
+    """
+    def __init__(self, tick=0.005, slots=512, on_error=None):
+        self.tick = tick
+        self.on_error = on_error  # Called with (what, exception) when a callback raises
+        self.slots = [[] for _ in range(slots)]
+        self.start = time.monotonic()
+        self.current = 0  # Last tick processed
+        self.pending = 0
+        self.cond = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) on the wheel thread after delay seconds"""
+        with self.cond:
+            elapsed = time.monotonic() - self.start
+            if self.pending == 0:
+                # Nothing was waiting, so skip the ticks that passed while idle
+                self.current = max(self.current, int(elapsed / self.tick))
+            # Ticks are monotonic in the deadline, so equal or later deadlines never fire earlier
+            target = max(math.ceil((elapsed + delay) / self.tick), self.current + 1)
+            self.slots[target % len(self.slots)].append((target, callback, args))
+            self.pending += 1
+            self.cond.notify()
+
+    def run(self):
+        """Advance the wheel and fire due timers"""
+        while True:
+            with self.cond:
+                while self.pending == 0:
+                    self.cond.wait()
+                wait = self.start + (self.current + 1) * self.tick - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                self.current += 1
+                slot = self.slots[self.current % len(self.slots)]
+                due = [timer for timer in slot if timer[0] <= self.current]
+                if due:
+                    slot[:] = [timer for timer in slot if timer[0] > self.current]
+                    self.pending -= len(due)
+
+            for target, callback, args in due:
+                try:
+                    callback(*args)
+                except Exception as e:
+                    if self.on_error:
+                        self.on_error('timer callback', e)
+                    else:
+                        print(f"Timer callback error: {e}")
+
+class DelayProfile:
+    """Latency model for one link or message type.
+
+    dist is 'fixed' (delay), 'uniform' (low..high) or 'lognormal' (median and
+    sigma of the underlying normal). drop is the probability the message is
+    lost, reorder the probability it skips the link's FIFO ordering and is held
+    back by an extra reorder_delay.
+    """
+    def __init__(self, dist='fixed', delay=0, low=0, high=0, median=0, sigma=0.5,
+                 drop=0.0, reorder=0.0, reorder_delay=None):
+        if dist not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f"unknown delay distribution '{dist}'")
+        self.dist = dist
+        self.delay = delay
+        self.low = low
+        self.high = high
+        self.median = median
+        self.sigma = sigma
+        self.drop = drop
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+
+    def sample(self, rng):
+        """Return (delay, in_order) for one message, or None if it is dropped"""
+        if self.drop and rng.random() < self.drop:
+            return None
+        if self.dist == 'uniform':
+            delay = rng.uniform(self.low, self.high)
+        elif self.dist == 'lognormal':
+            delay = rng.lognormvariate(0, self.sigma) * self.median
+        else:
+            delay = self.delay
+        if self.reorder and rng.random() < self.reorder:
+            extra = self.reorder_delay if self.reorder_delay is not None else delay
+            return delay + rng.uniform(0, extra), False
+        return delay, True
+
+class NetworkEmulator:
+    """Schedules delivery of received messages according to per-link profiles.
+
+    Profiles are looked up from most to least specific: link and message type,
+    link default, message type, then the global (or master) default. Messages
+    that are not reordered keep FIFO order per link, as TCP would.
+    """
+    def __init__(self, config=None, scheduler=None, clock=time.monotonic):
+        config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.scheduler = scheduler
+        self.clock = clock  # Must agree with the scheduler's notion of time
+        self.rng = random.Random(config.get('seed'))
+        self.default = DelayProfile(**config['default'])
+        self.master = DelayProfile(**config['master'])
+        self.messages = {msg_type: DelayProfile(**profile)
+                         for msg_type, profile in config.get('messages', {}).items()}
+        self.links = {}
+        for link, spec in config.get('links', {}).items():
+            src, dst = link.split('->')
+            self.links[(src.strip(), dst.strip())] = (
+                DelayProfile(**spec['default']) if 'default' in spec else None,
+                {msg_type: DelayProfile(**profile) for msg_type, profile in spec.get('messages', {}).items()}
+            )
+        self.release_delay = config['release_delay']
+        self.insert_pause = config['insert_pause']
+        self.last_delivery = {}  # (src, dst) -> time of the latest in-order delivery
+        self.held = {}  # (src, dst) -> in-order deliveries waiting for a timer, oldest first
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, scheduler=None):
+        """Load an emulator from a JSON config file (None for the defaults)"""
+        if not path:
+            return cls(None, scheduler)
+        with open(path, 'r') as f:
+            return cls(json.load(f), scheduler)
+
+    def profile(self, src, dst, msg_type):
+        """Resolve the profile for a message on a link"""
+        link = self.links.get((str(src), str(dst)))
+        if link:
+            link_default, link_messages = link
+            if msg_type in link_messages:
+                return link_messages[msg_type]
+            if link_default:
+                return link_default
+        if src == 'master':
+            return self.master
+        return self.messages.get(msg_type, self.default)
+
+    def deliver(self, src, dst, message, callback, *args):
+        """Deliver message by calling callback(*args) once its delay has passed"""
+        with self.lock:
+            sample = self.profile(src, dst, message.get('type')).sample(self.rng)
+            if sample is None:
+                return
+            delay, in_order = sample
+            now = self.clock()
+            held = False
+            if in_order:
+                key = (src, dst)
+                deliver_at = max(now + delay, self.last_delivery.get(key, 0))
+                self.last_delivery[key] = deliver_at
+                delay = deliver_at - now
+                waiting = self.held.setdefault(key, deque())
+                if waiting or delay > 0:
+                    # Timers with (nearly) equal deadlines may fire in either order,
+                    # so each one delivers whatever is oldest on the link instead
+                    waiting.append((callback, args))
+                    callback, args = self.deliver_held, (key,)
+                    held = True
+        if held:
+            self.scheduler.call_later(max(delay, 0), callback, *args)
+        elif delay <= 0:
+            callback(*args)
+        else:
+            self.scheduler.call_later(delay, callback, *args)
+
+    def after_link(self, src, dst, callback, *args):
+        """Call callback(*args) once every in-order message already sent on a link has been delivered"""
+        with self.lock:
+            key = (src, dst)
+            now = self.clock()
+            deliver_at = max(now, self.last_delivery.get(key, 0))
+            self.last_delivery[key] = deliver_at
+            waiting = self.held.setdefault(key, deque())
+            held = bool(waiting) or deliver_at > now
+            if held:
+                waiting.append((callback, args))
+        if held:
+            self.scheduler.call_later(deliver_at - now, self.deliver_held, key)
+        else:
+            callback(*args)
+
+    def deliver_held(self, key):
+        """Deliver the oldest held message on a link"""
+        with self.lock:
+            callback, args = self.held[key][0]
+        try:
+            callback(*args)
+        finally:
+            # Dequeue only now, so a new message cannot skip ahead while this one is handled
+            with self.lock:
+                self.held[key].popleft()
@@ -0,0 +1,87 @@
+import threading
+import socket
+import queue
+import time
+
+import wire
+
+COALESCE_MAX_BYTES = 1 << 16  # Stop adding messages to a write past this size
+
+def set_nodelay(sock):
+    """Disable Nagle's algorithm; coalescing is done by the writers instead"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+class OutboundQueue:
+    """Messages waiting to be written to one connection, sent by a dedicated writer thread.
+
+    Callers only enqueue, so a slow or stuck socket holds up its own writer
+    and nothing else. Messages are encoded on the writer thread in the
+    format chosen when they were queued, and sent in queue order. Whatever
+    has queued up by the time the writer is free goes out in a single write;
+    with a coalesce window the writer also waits that long for more before
+    writing. An idle queue is written out at once.
+    """
+    def __init__(self, conn, name, on_sent=None, on_error=None, window=0.0, max_bytes=COALESCE_MAX_BYTES):
+        self.conn = conn
+        self.name = name
+        self.on_sent = on_sent  # Called with (bytes, messages) for each write
+        self.on_error = on_error  # Called with (name, exception) when the connection fails
+        self.window = window
+        self.max_bytes = max_bytes
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def put(self, message, fmt=wire.FORMAT_JSON):
+        """Queue one message"""
+        if not self.closed:
+            self.queue.put((message, fmt))
+
+    def close(self):
+        """Stop the writer once everything queued so far is sent"""
+        self.closed = True
+        self.queue.put(None)
+
+    def collect(self, first):
+        """Encode first plus whatever else can join its write; returns (chunks, stopping)"""
+        chunks = [wire.encode(*first)]
+        size = len(chunks[0])
+        deadline = time.monotonic() + self.window if self.window else None
+        while size < self.max_bytes:
+            try:
+                if deadline is None:
+                    item = self.queue.get_nowait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return chunks, True
+            chunks.append(wire.encode(*item))
+            size += len(chunks[-1])
+        return chunks, False
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                chunks, stopping = self.collect(item)
+                data = b''.join(chunks)
+                self.conn.sendall(data)
+            except Exception as e:
+                self.closed = True
+                if self.on_error:
+                    self.on_error(self.name, e)
+                return
+            if self.on_sent:
+                self.on_sent(len(data), len(chunks))
+
+    def __len__(self):
+        return self.queue.qsize()
@@ -0,0 +1,40 @@
+import bisect
+import zlib
+
+class HashPartitioner:
+    """Spread perms over count partitions by a stable hash"""
+    def __init__(self, count=1):
+        if count < 1:
+            raise ValueError("need at least one partition")
+        self.count = count
+
+    def part(self, perm):
+        """Partition that perm's lock lives in"""
+        if self.count == 1:
+            return 0
+        return zlib.crc32(str(perm).encode('utf-8')) % self.count
+
+class RangePartitioner:
+    """Split integer perms into ranges at the given boundaries.
+
+    With bounds [100, 200] there are three partitions: perms below 100,
+    100..199, and 200 and up. Perms that are not integers are hashed.
+    """
+    def __init__(self, bounds):
+        self.bounds = sorted(bounds)
+        self.count = len(self.bounds) + 1
+
+    def part(self, perm):
+        try:
+            return bisect.bisect_right(self.bounds, int(perm))
+        except (TypeError, ValueError):
+            return zlib.crc32(str(perm).encode('utf-8')) % self.count
+
+def parse_partitions(spec):
+    """Build a partitioner from '4', 'hash:4' or 'range:1000,5000'"""
+    spec = str(spec).strip()
+    if spec.startswith('range:'):
+        return RangePartitioner([int(bound) for bound in spec[len('range:'):].split(',') if bound.strip()])
+    if spec.startswith('hash:'):
+        spec = spec[len('hash:'):]
+    return HashPartitioner(int(spec))
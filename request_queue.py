@@ -0,0 +1,65 @@
+import heapq
+
+class RequestQueue:
+    """Lamport request queue ordered by (lamport_ts, client_id).
+
+    Requests live in a binary heap, so enqueue is O(log n). A per-client index
+    finds a client's entries without scanning; removal marks them dead and dead
+    entries are popped as soon as they reach the top, which keeps the live head
+    at heap[0] for an O(1) head().
+    """
+    def __init__(self):
+        self.heap = []  # [timestamp, client_id, alive]
+        self.index = {}  # client_id -> {timestamp: entry}
+        self.size = 0
+
+    def push(self, timestamp, client_id):
+        """Add a request"""
+        entry = [timestamp, client_id, True]
+        heapq.heappush(self.heap, entry)
+        self.index.setdefault(client_id, {})[timestamp] = entry
+        self.size += 1
+
+    def remove(self, client_id, timestamp=None):
+        """Remove the request of client_id at timestamp, or all of its requests"""
+        entries = self.index.get(client_id)
+        if not entries:
+            return
+        if timestamp is None:
+            removed = list(entries.values())
+            entries.clear()
+        else:
+            entry = entries.pop(timestamp, None)
+            removed = [entry] if entry else []
+        if not entries:
+            del self.index[client_id]
+
+        for entry in removed:
+            entry[2] = False
+            self.size -= 1
+        self._prune()
+
+    def _prune(self):
+        """Drop dead entries from the top, and compact if most are dead"""
+        while self.heap and not self.heap[0][2]:
+            heapq.heappop(self.heap)
+        if len(self.heap) > 2 * self.size + 64:
+            self.heap = [entry for entry in self.heap if entry[2]]
+            heapq.heapify(self.heap)
+
+    def head(self):
+        """Return the (timestamp, client_id) at the head of the queue, or None"""
+        if self.heap:
+            return (self.heap[0][0], self.heap[0][1])
+        return None
+
+    def __contains__(self, request):
+        timestamp, client_id = request
+        return timestamp in self.index.get(client_id, ())
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        """Iterate live requests in queue order"""
+        return iter(sorted((entry[0], entry[1]) for entry in self.heap if entry[2]))
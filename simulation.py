@@ -0,0 +1,403 @@
+import contextlib
+import traceback
+import argparse
+import random
+import heapq
+import json
+import time
+import sys
+import os
+from collections import deque
+
+import wire
+from client import Client, MUTEX_LAMPORT, MUTEX_RICART_AGRAWALA, MUTEX_TOKEN
+from master import Master, WRITE_COMMANDS
+from partition import parse_partitions
+from store import STORE_DICT, STORE_COMPACT
+from eventlog import LEVELS, make_log
+from benchmark import DEFAULT_MIX, parse_mix, workload_commands
+
+# Random delays, so every seed explores a different interleaving (the lab's
+# fixed 3 s hops would replay the same schedule whatever the seed)
+SIM_NETWORK = {
+    'default': {'dist': 'uniform', 'low': 0.001, 'high': 0.02},
+    'master': {'dist': 'uniform', 'low': 0, 'high': 0.005},
+    'release_delay': 0,
+    'insert_pause': 0
+}
+MAX_VIRTUAL_TIME = 24 * 3600  # Virtual seconds before a run counts as stuck
+
+class SimConnection:
+    """One direction of an in-memory link; messages are still encoded and framed as on a socket"""
+    def __init__(self, sim, fmt, receive):
+        self.sim = sim
+        self.fmt = fmt
+        self.receive = receive  # Called with (message, reply connection)
+        self.reader = wire.FrameReader(fmt)
+        self.reply = None  # Connection going the other way, handed to the receiver
+
+    def send(self, message):
+        self.reader.feed(wire.encode(message, self.fmt))
+        for decoded in self.reader:
+            # Never deliver inline: the sender may be holding its lock
+            self.sim.call_later(0, self.receive, decoded, self.reply)
+
+class SimClient(Client):
+    """Client whose sockets and timers belong to a simulation"""
+    def __init__(self, sim, client_id, peers, **kwargs):
+        super().__init__(client_id, None, {peer: None for peer in peers}, **kwargs)
+        self.sim = sim
+        self.network.scheduler = sim
+        self.network.clock = sim.now
+        self.network.rng = random.Random(sim.rng.getrandbits(64))
+        self.ready = True
+        self.applied = {}  # perm -> grades in the order this replica applied them
+
+    def write_message(self, conn, message):
+        conn.send(message)
+
+    def apply_insert(self, perm, grade):
+        self.applied.setdefault(perm, []).append(grade)
+        return super().apply_insert(perm, grade)
+
+    def execute_insert(self, request):
+        self.sim.enter(self.client_id, request)
+        super().execute_insert(request)
+
+    def finish_insert(self, request):
+        self.sim.leave(self.client_id, request)
+        super().finish_insert(request)
+
+class SimMaster(Master):
+    """Master driven by simulation events that checks each answer against a serial replay of the input"""
+    def __init__(self, sim, commands, clients, pipeline, wire_format, insert_pause, incremental):
+        super().__init__(None, None, None, clients, pipeline, wire_format, insert_pause, incremental)
+        self.sim = sim
+        self.commands = enumerate(commands)
+        self.waiting = None  # Next command, held back by the window, a conflict or a wait
+        self.paused = False
+        self.in_flight = {}  # req_id -> command
+        self.results = {}
+        self.order = deque()
+        self.expected = {}  # perm -> grade after the writes dispatched so far, in input order
+        self.done = False
+
+    def send_message(self, client_id, message):
+        self.metrics.inc('messages_sent', label=message['type'])
+        self.client_sockets[client_id].send(message)
+
+    def advance(self):
+        """Dispatch commands until the window is full, a conflict blocks or the input runs out"""
+        while not self.paused:
+            if self.waiting is None:
+                item = next(self.commands, None)
+                if item is None:
+                    self.done = not self.in_flight
+                    return
+                index, command = item
+                command = command.strip()
+                cmd = self.parse_command(command) if command else None
+                if cmd is None:
+                    continue
+                print(f"Master processing: {command}")
+                cmd['index'] = index
+                self.waiting = cmd
+            cmd = self.waiting
+            if cmd['op'] == 'wait':
+                if self.in_flight:
+                    return
+                self.waiting = None
+                self.pause(cmd['time'])
+                continue
+            if len(self.in_flight) >= max(self.pipeline, 1) or any(self.conflicts(cmd, other) for other in self.in_flight.values()):
+                return
+            self.waiting = None
+            self.expect(cmd)
+            cmd['req_id'] = self.dispatch(cmd)
+            cmd['sent_at'] = self.sim.now()
+            self.in_flight[cmd['req_id']] = cmd
+            self.order.append(cmd['index'])
+
+    def pause(self, seconds):
+        self.paused = True
+        self.sim.call_later(seconds, self.resume)
+
+    def resume(self):
+        self.paused = False
+        self.advance()
+
+    def expect(self, cmd):
+        """Record what a serial run would answer at this point of the input"""
+        if cmd['op'] == 'insert':
+            self.expected[cmd['perm']] = cmd['grade']
+        elif cmd['op'] == 'batch_insert':
+            self.expected.update(cmd['entries'])
+        elif cmd['op'] == 'lookup':
+            cmd['expected'] = self.expected.get(cmd['perm'], 'NOT FOUND')
+        elif cmd['op'] == 'dictionary':
+            cmd['expected'] = dict(self.expected)
+
+    def receive(self, client_id, message):
+        """Handle one response from a client"""
+        self.metrics.inc('messages_received', label=message.get('type'))
+        response = self.merge_chunk(message)
+        if response is None:
+            return
+        cmd = self.in_flight.pop(response.get('req_id'), None)
+        if cmd is None:
+            self.sim.fail(f"unexpected {response.get('type')} from Client {client_id} for request {response.get('req_id')}")
+            return
+        self.metrics.observe('command_ms', (self.sim.now() - cmd['sent_at']) * 1000, label=cmd['op'])
+        output_line = self.command_result(cmd, response)
+        self.check(cmd, response, output_line)
+        if output_line:
+            print(f"OUTPUT: {output_line}")
+        self.results[cmd['index']] = output_line
+        self.emit_in_order(self.order, self.results)
+        if output_line and self.pipeline == 0 and cmd['op'] in WRITE_COMMANDS and self.insert_pause:
+            self.pause(self.insert_pause)
+        self.advance()
+
+    def check(self, cmd, response, output_line):
+        """Compare an answer with the serial replay"""
+        where = f"{cmd['op']} on Client {cmd['client_id']} (input line {cmd['index'] + 1})"
+        if cmd['op'] in WRITE_COMMANDS:
+            if output_line is None:
+                self.sim.fail(f"{where} failed: {response.get('type')}")
+        elif cmd['op'] == 'lookup':
+            if response.get('grade') != cmd['expected']:
+                self.sim.fail(f"{where} returned {response.get('grade')!r}, a serial run returns {cmd['expected']!r}")
+        elif cmd['op'] == 'dictionary':
+            if response.get('type') == 'DICTIONARY_RESULT':
+                got = response['dictionary']
+            else:
+                got = self.dictionary_mirrors[cmd['client_id']]['grades']
+            if got != cmd['expected']:
+                self.sim.fail(f"{where} differs from a serial run at perms {differing(got, cmd['expected'])}")
+            elif list(got) != list(cmd['expected']):
+                self.sim.fail(f"{where} lists its perms in a different order from a serial run, "
+                              f"first at position {first_reordered(got, cmd['expected'])}")
+
+def differing(first, second, limit=5):
+    """A few perms whose grades differ between two dictionaries"""
+    perms = sorted(perm for perm in set(first) | set(second) if first.get(perm) != second.get(perm))
+    return ', '.join(perms[:limit]) + (f" and {len(perms) - limit} more" if len(perms) > limit else '')
+
+def first_reordered(first, second):
+    """Position of the first perm two dictionaries with the same items list differently"""
+    return next(position for position, (a, b) in enumerate(zip(first, second)) if a != b)
+
+def make_logs(nodes, level='off', fmt='text'):
+    """One event log per client id, to be shared by every run"""
+    return {client_id: make_log(f"client{client_id}", f"Client {client_id}", level, fmt)
+            for client_id in range(1, nodes + 1)}
+
+class Simulation:
+    """One seeded run of a whole cluster and its master in a single process, on a virtual clock.
+
+    Sockets become in-memory links that still encode and frame messages, and
+    every timer and delivery is an entry in one event heap. Delays come from
+    the network profile through RNGs derived from the seed, so a seed always
+    replays the same interleaving. Mutual exclusion is checked as clients
+    enter and leave the critical section, answers against a serial replay,
+    and the replicas once the run has gone quiet.
+    """
+    def __init__(self, commands, seed, nodes=3, mutex=MUTEX_LAMPORT, partitions=None, pipeline=16,
+                 wire_format=wire.FORMAT_JSON, network_config=None, store=STORE_DICT, incremental=False, logs=None):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.clock = 0.0
+        self.events = []  # Heap of (time, sequence, callback, args)
+        self.sequence = 0
+        self.processed = 0
+        self.violations = []
+        self.holders = {}  # Lock partition -> (client_id, rid) in its critical section
+        self.critical_sections = 0
+        self.mutex = mutex
+        config = network_config or SIM_NETWORK
+        logs = logs or make_logs(nodes)
+        fmt = wire.FORMAT_BINARY if wire_format == wire.FORMAT_BINARY else wire.FORMAT_JSON
+
+        members = list(range(1, nodes + 1))
+        self.clients = {}
+        for client_id in members:
+            self.clients[client_id] = SimClient(self, client_id, [other for other in members if other != client_id],
+                                                wire_format=wire_format, network_config=config, mutex=mutex,
+                                                store=store, log=logs[client_id], partitions=partitions)
+        for client in self.clients.values():
+            for other_id, other in self.clients.items():
+                if other is not client:
+                    client.client_sockets[other_id] = SimConnection(self, fmt, other.deliver)
+
+        insert_pause = config.get('insert_pause', 0)
+        self.master = SimMaster(self, commands, {client_id: None for client_id in members}, pipeline,
+                                wire_format, insert_pause, incremental)
+        for client_id, client in self.clients.items():
+            to_client = SimConnection(self, fmt, client.deliver)
+            to_client.reply = SimConnection(self, fmt, lambda message, reply, client_id=client_id:
+                                            self.master.receive(client_id, message))
+            self.master.client_sockets[client_id] = to_client
+
+    def now(self):
+        return self.clock
+
+    def call_later(self, delay, callback, *args):
+        """Schedule callback(*args) delay virtual seconds from now"""
+        self.sequence += 1
+        heapq.heappush(self.events, (self.clock + max(delay, 0), self.sequence, callback, args))
+
+    def fail(self, violation):
+        self.violations.append(f"t={self.clock:.6f}: {violation}")
+
+    def enter(self, client_id, request):
+        """A client entered the critical section for request"""
+        self.critical_sections += 1
+        for part in request.parts:
+            holder = self.holders.get(part)
+            if holder is not None:
+                self.fail(f"mutual exclusion violated: Client {client_id} request {request.rid} entered "
+                          f"partition {part} held by Client {holder[0]} request {holder[1]}")
+            self.holders[part] = (client_id, request.rid)
+
+    def leave(self, client_id, request):
+        """A client left the critical section for request"""
+        for part in request.parts:
+            if self.holders.get(part) == (client_id, request.rid):
+                del self.holders[part]
+
+    def run(self, max_time=MAX_VIRTUAL_TIME):
+        """Run to quiescence or the first violation; returns True if every invariant held"""
+        self.master.advance()
+        while self.events and not self.violations:
+            at, sequence, callback, args = heapq.heappop(self.events)
+            if at > max_time:
+                self.fail(f"still running after {max_time} s of virtual time")
+                break
+            self.clock = at
+            self.processed += 1
+            try:
+                callback(*args)
+            except Exception:
+                self.fail(f"exception in event handler:\n{traceback.format_exc()}")
+        if not self.violations:
+            self.check_quiescent()
+        return not self.violations
+
+    def check_quiescent(self):
+        """Invariants once no event is left: everything answered, nothing held, replicas identical"""
+        master = self.master
+        if not master.done or master.in_flight or master.waiting is not None:
+            self.fail(f"stalled with {len(master.in_flight)} commands in flight: "
+                      f"{sorted(cmd['index'] + 1 for cmd in master.in_flight.values())[:10]} (input lines)")
+        for client_id, client in self.clients.items():
+            if client.requests or client.active or client.backlog or client.deferred_replies:
+                self.fail(f"Client {client_id} left {len(client.requests)} inserts outstanding")
+            queued = sum(len(queue) for queue in client.request_queues)
+            if queued:
+                self.fail(f"Client {client_id} left {queued} entries in its request queues")
+        if self.mutex == MUTEX_TOKEN:
+            holders = [client_id for client_id, client in self.clients.items() if client.token is not None]
+            if len(holders) != 1:
+                self.fail(f"token held by {holders or 'nobody'}")
+
+        # Replicas must agree on contents and on the order writes to each perm were applied
+        reference_id, reference = next(iter(self.clients.items()))
+        for client_id, client in self.clients.items():
+            if client is reference:
+                continue
+            if client.dictionary.snapshot() != reference.dictionary.snapshot():
+                self.fail(f"Client {client_id} and Client {reference_id} dictionaries differ at perms "
+                          f"{differing(client.dictionary.snapshot(), reference.dictionary.snapshot())}")
+            for perm in set(client.applied) | set(reference.applied):
+                if client.applied.get(perm) != reference.applied.get(perm):
+                    self.fail(f"Client {client_id} applied perm {perm} as {client.applied.get(perm)}, "
+                              f"Client {reference_id} as {reference.applied.get(perm)}")
+                    break
+
+def run_simulations(args):
+    """Run args.runs seeds and report each failure; returns the number of failed runs"""
+    if args.inputfile:
+        with open(args.inputfile, 'r') as f:
+            fixed_commands = f.read().splitlines()
+    network_config = None
+    if args.netdelay:
+        with open(args.netdelay, 'r') as f:
+            network_config = json.load(f)
+    partitions = parse_partitions(args.partitions)
+    wire_format = wire.FORMAT_BINARY if args.wire == 'binary' else wire.FORMAT_JSON
+    logs = make_logs(args.nodes, args.loglevel, args.logformat)
+    targets = [int(t) for t in args.targets.split(',')] if args.targets else list(range(1, args.nodes + 1))
+    mix = parse_mix(args.mix)
+
+    failed = 0
+    events = 0
+    virtual = 0.0
+    started = time.time()
+    quiet = open(os.devnull, 'w') if not args.verbose else None
+    for seed in range(args.seed, args.seed + args.runs):
+        if args.inputfile:
+            commands = fixed_commands
+        else:
+            commands = list(workload_commands(args.ops, mix, args.keys, args.skew, targets, args.batchsize, seed))
+        sim = Simulation(commands, seed, args.nodes, args.mutex, partitions, args.pipeline, wire_format,
+                         network_config, args.store, args.incremental, logs)
+        with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+            ok = sim.run(args.maxtime)
+        events += sim.processed
+        virtual += sim.clock
+        if args.outputfile and seed == args.seed:
+            with open(args.outputfile, 'w') as f:
+                for line in sim.master.output_lines:
+                    f.write(line + '\n')
+        if not ok:
+            failed += 1
+            print(f"Seed {seed}: FAILED after {sim.processed} events")
+            for violation in sim.violations:
+                print(f"  {violation}")
+        for log in logs.values():
+            log.flush()
+    if quiet:
+        quiet.close()
+
+    print(f"{args.runs} runs, {failed} failed: {events} events, {virtual:.1f} s of virtual time "
+          f"in {time.time() - started:.2f} s")
+    if failed:
+        print(f"Replay a failing seed with -seed <seed> -runs 1 -loglevel info")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description='Run clients and master in one process on a virtual clock '
+                                                 'and check the protocol invariants over many seeds')
+    parser.add_argument('-inputfile', type=str, default=None, help='Replay this master input file in every run '
+                                                                    '(default: a generated workload per seed)')
+    parser.add_argument('-outputfile', type=str, default=None, help="Write the first run's master output here")
+    parser.add_argument('-ops', type=int, default=100, help='Commands per generated workload')
+    parser.add_argument('-mix', type=str, default=DEFAULT_MIX,
+                        help='Command weights, from insert, batch_insert, lookup and dictionary')
+    parser.add_argument('-keys', type=int, default=20, help='Number of distinct perms')
+    parser.add_argument('-skew', type=float, default=1.0, help='Zipf exponent for perm popularity (0 = uniform)')
+    parser.add_argument('-targets', type=str, default=None, help='Clients to send commands to, e.g. 1,2 (default all)')
+    parser.add_argument('-batchsize', type=int, default=3, help='Entries per batch_insert')
+    parser.add_argument('-nodes', type=int, default=3, help='Cluster size')
+    parser.add_argument('-mutex', choices=[MUTEX_LAMPORT, MUTEX_RICART_AGRAWALA, MUTEX_TOKEN], default=MUTEX_LAMPORT)
+    parser.add_argument('-partitions', type=str, default='1', help="Lock partitions, e.g. 4 or 'range:10'")
+    parser.add_argument('-pipeline', type=int, default=16, help='Master pipeline window (0 = serial)')
+    parser.add_argument('-wire', choices=['json', 'binary'], default='json')
+    parser.add_argument('-store', choices=[STORE_DICT, STORE_COMPACT], default=STORE_DICT)
+    parser.add_argument('-incremental', action='store_true', help='Fetch dictionaries as changes since the last one')
+    parser.add_argument('-netdelay', type=str, default=None,
+                        help='Delay profile file (default: random 1-20 ms hops, no release delay or insert pause)')
+    parser.add_argument('-seed', type=int, default=1, help='First seed')
+    parser.add_argument('-runs', type=int, default=100, help='Number of seeds to run')
+    parser.add_argument('-maxtime', type=float, default=MAX_VIRTUAL_TIME, help='Virtual seconds before a run counts as stuck')
+    parser.add_argument('-loglevel', choices=list(LEVELS), default='off', help='Client event log level')
+    parser.add_argument('-logformat', choices=['text', 'json'], default='text')
+    parser.add_argument('-verbose', action='store_true', help="Show the master's progress messages")
+    args = parser.parse_args()
+    if parse_partitions(args.partitions).count > 1 and args.mutex != MUTEX_LAMPORT:
+        parser.error('-partitions needs -mutex lamport')
+
+    sys.exit(1 if run_simulations(args) else 0)
+
+if __name__ == "__main__":
+    main()
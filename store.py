@@ -0,0 +1,233 @@
+from collections import OrderedDict
+from array import array
+import bisect
+
+STORE_DICT = 'dict'
+STORE_COMPACT = 'compact'
+
+class GradeStore:
+    """The replicated perm -> grade dictionary, with a version per entry.
+
+    Every applied insert bumps this node's version counter and stamps the
+    entry with it, so changes_since() can hand out only what changed after a
+    given version. Versions are local to the node: all inserts reach a node
+    in mutual-exclusion order, but callers should only compare versions
+    that came from the same node.
+    """
+    def __init__(self):
+        self.grades = {}  # perm -> grade, in first-insert order
+        self.versions = OrderedDict()  # perm -> version of its latest write, oldest first
+        self.created = {}  # perm -> version of its first write
+        self.version = 0
+
+    def accepts(self, perm):
+        """Check whether perm can be stored"""
+        return True
+
+    def get(self, perm, default=None):
+        """Look up a grade"""
+        return self.grades.get(str(perm), default)
+
+    def set(self, perm, grade, version=None):
+        """Insert or update a grade and return the version it was written at"""
+        perm = str(perm)
+        self.version = version if version is not None else self.version + 1
+        self.grades[perm] = grade
+        self.versions[perm] = self.version
+        self.versions.move_to_end(perm)
+        self.created.setdefault(perm, self.version)
+        return self.version
+
+    def load(self, entries, version):
+        """Replace the contents with (perm, grade, version, created) entries in dictionary order"""
+        self.grades = {perm: grade for perm, grade, entry_version, created in entries}
+        self.versions = OrderedDict((perm, entry_version)
+                                    for perm, grade, entry_version, created in sorted(entries, key=lambda e: e[2]))
+        self.created = {perm: created for perm, grade, entry_version, created in entries}
+        self.version = version
+
+    def snapshot(self):
+        """Return a copy of the whole dictionary"""
+        return dict(self.grades)
+
+    def entries(self):
+        """Return [(perm, grade, version, created)] in dictionary order"""
+        return [(perm, grade, self.versions[perm], self.created[perm]) for perm, grade in self.grades.items()]
+
+    def changes_since(self, version):
+        """Return [(perm, grade, version, created)] written after version, oldest first"""
+        changes = []
+        for perm, entry_version in reversed(self.versions.items()):
+            if entry_version <= version:
+                break
+            changes.append((perm, self.grades[perm], entry_version, self.created[perm]))
+        changes.reverse()
+        return changes
+
+    def __contains__(self, perm):
+        return str(perm) in self.grades
+
+    def __len__(self):
+        return len(self.grades)
+
+class CompactGradeStore:
+    """GradeStore for integer perms, kept in flat arrays instead of dicts.
+
+    Entries are stored densely in first-insert order: the perm, a grade code
+    and the two versions each live in a parallel array, and grades are
+    interned so each distinct grade string is held once. An open-addressing
+    table of dense indices finds a perm. Writes are also appended to a
+    version-ordered log so changes_since() can bisect to the first change
+    instead of scanning. A record costs roughly 40 bytes instead of the
+    several hundred the dict-based store needs.
+
+    Perms must be 64-bit integers in canonical form ('42', not '042' or 'abc').
+    """
+    EMPTY = 0  # Table slots hold dense index + 1
+    KEY_MIN, KEY_MAX = -2 ** 63, 2 ** 63 - 1  # Perms live in an array('q')
+
+    def __init__(self):
+        self.perms = array('q')
+        self.codes = array('B')  # Widened to 'H' past 256 distinct grades and 'I' past 65536
+        self.entry_versions = array('q')
+        self.entry_created = array('q')
+        self.grade_names = []  # code -> grade
+        self.grade_codes = {}  # grade -> code
+        self.table = array('i', bytes(4 * 8))
+        self.mask = 7
+        self.log_versions = array('q')  # Versions of past writes, ascending
+        self.log_indices = array('i')  # Dense index each write went to
+        self.version = 0
+
+    def _key(self, perm):
+        """Parse a perm into its integer key, or None if it is not a canonical 64-bit integer"""
+        if isinstance(perm, int):
+            key = perm
+        else:
+            try:
+                key = int(perm)
+            except (TypeError, ValueError):
+                return None
+            if str(key) != perm:
+                return None
+        return key if self.KEY_MIN <= key <= self.KEY_MAX else None
+
+    def _slot(self, key):
+        """Return (slot, dense index or -1) for key"""
+        slot = (key * 0x9E3779B97F4A7C15 >> 16) & self.mask
+        while True:
+            index = self.table[slot]
+            if index == self.EMPTY:
+                return slot, -1
+            if self.perms[index - 1] == key:
+                return slot, index - 1
+            slot = (slot + 1) & self.mask
+
+    def _grow(self):
+        """Double the table and reinsert every entry"""
+        self.table = array('i', bytes(4 * 2 * len(self.table)))
+        self.mask = len(self.table) - 1
+        for index, key in enumerate(self.perms):
+            slot, _ = self._slot(key)
+            self.table[slot] = index + 1
+
+    def _code(self, grade):
+        """Intern grade and return its code"""
+        code = self.grade_codes.get(grade)
+        if code is None:
+            code = len(self.grade_names)
+            if code == 256 and self.codes.typecode == 'B':
+                self.codes = array('H', self.codes)
+            elif code == 65536 and self.codes.typecode == 'H':
+                self.codes = array('I', self.codes)
+            self.grade_codes[grade] = code
+            self.grade_names.append(grade)
+        return code
+
+    def accepts(self, perm):
+        """Check whether perm can be stored (a canonical integer that fits in 64 bits)"""
+        return self._key(str(perm)) is not None
+
+    def get(self, perm, default=None):
+        """Look up a grade"""
+        key = self._key(str(perm))
+        if key is None:
+            return default
+        _, index = self._slot(key)
+        return self.grade_names[self.codes[index]] if index >= 0 else default
+
+    def set(self, perm, grade, version=None):
+        """Insert or update a grade and return the version it was written at"""
+        key = self._key(str(perm))
+        if key is None:
+            raise ValueError(f"compact store needs 64-bit integer perms, got '{perm}'")
+        self.version = version if version is not None else self.version + 1
+        code = self._code(str(grade))
+        slot, index = self._slot(key)
+        if index < 0:
+            index = len(self.perms)
+            self.perms.append(key)
+            self.codes.append(code)
+            self.entry_versions.append(self.version)
+            self.entry_created.append(self.version)
+            self.table[slot] = index + 1
+            if 2 * len(self.perms) > len(self.table):
+                self._grow()
+        else:
+            self.codes[index] = code
+            self.entry_versions[index] = self.version
+        self.log_versions.append(self.version)
+        self.log_indices.append(index)
+        if len(self.log_versions) > 2 * len(self.perms) + 64:
+            self._compact_log()
+        return self.version
+
+    def _compact_log(self):
+        """Drop superseded writes from the log"""
+        live = sorted(range(len(self.perms)), key=self.entry_versions.__getitem__)
+        self.log_versions = array('q', (self.entry_versions[index] for index in live))
+        self.log_indices = array('i', live)
+
+    def load(self, entries, version):
+        """Replace the contents with (perm, grade, version, created) entries in dictionary order"""
+        self.__init__()
+        for perm, grade, entry_version, created in entries:
+            self.set(perm, grade, entry_version)
+            self.entry_created[len(self.perms) - 1] = created
+        self._compact_log()
+        self.version = version
+
+    def snapshot(self):
+        """Return a copy of the whole dictionary"""
+        names = self.grade_names
+        return {str(key): names[code] for key, code in zip(self.perms, self.codes)}
+
+    def entries(self):
+        """Return [(perm, grade, version, created)] in dictionary order"""
+        names = self.grade_names
+        return [(str(key), names[code], entry_version, created)
+                for key, code, entry_version, created
+                in zip(self.perms, self.codes, self.entry_versions, self.entry_created)]
+
+    def changes_since(self, version):
+        """Return [(perm, grade, version, created)] written after version, oldest first"""
+        changes = []
+        start = bisect.bisect_right(self.log_versions, version)
+        for log_version, index in zip(self.log_versions[start:], self.log_indices[start:]):
+            if self.entry_versions[index] == log_version:
+                changes.append((str(self.perms[index]), self.grade_names[self.codes[index]],
+                                log_version, self.entry_created[index]))
+        return changes
+
+    def __contains__(self, perm):
+        key = self._key(str(perm))
+        return key is not None and self._slot(key)[1] >= 0
+
+    def __len__(self):
+        return len(self.perms)
+
+def make_store(kind=STORE_DICT):
+    """Create an empty store of the given kind"""
+    if kind == STORE_COMPACT:
+        return CompactGradeStore()
+    return GradeStore()
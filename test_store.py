@@ -0,0 +1,27 @@
+import unittest
+
+from store import CompactGradeStore
+
+class CompactGradeStoreLimitsTest(unittest.TestCase):
+    def test_rejects_perms_outside_int64(self):
+        store = CompactGradeStore()
+        self.assertTrue(store.accepts(str(2 ** 63 - 1)))
+        self.assertTrue(store.accepts(str(-2 ** 63)))
+        self.assertFalse(store.accepts(str(2 ** 63)))
+        self.assertFalse(store.accepts('99999999999999999999'))
+        self.assertFalse(store.accepts(str(-2 ** 63 - 1)))
+        with self.assertRaises(ValueError):
+            store.set('99999999999999999999', 'A')
+        self.assertEqual(len(store), 0)
+
+    def test_widens_grade_codes_past_65536_grades(self):
+        store = CompactGradeStore()
+        for i in range(70000):
+            store.set(str(i), f"G{i}")
+        self.assertEqual(store.codes.typecode, 'I')
+        self.assertEqual(store.get('0'), 'G0')
+        self.assertEqual(store.get('65535'), 'G65535')
+        self.assertEqual(store.get('69999'), 'G69999')
+
+if __name__ == '__main__':
+    unittest.main()
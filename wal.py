@@ -0,0 +1,238 @@
+import threading
+import struct
+import zlib
+import shutil
+import mmap
+import time
+import os
+
+# Log record: body length, crc32(body), then the body
+RECORD_HEADER = struct.Struct('!II')
+RECORD_BODY = struct.Struct('!QHH')  # version, len(perm), len(grade)
+
+# Snapshot: magic, (version, count), then one entry per perm in dictionary order
+SNAPSHOT_MAGIC = b'GSNAP001'
+SNAPSHOT_HEADER = struct.Struct('!QQ')
+SNAPSHOT_ENTRY = struct.Struct('!QQHH')  # version, created, len(perm), len(grade)
+
+WAL_FILE = 'wal.log'
+OLD_WAL_FILE = 'wal.old'  # Log covered by the snapshot being written
+SNAPSHOT_FILE = 'snapshot.bin'
+
+class WriteAheadLog:
+    """Durable log of applied inserts for one client, plus compacted snapshots.
+
+    append() only buffers a record. A flusher thread writes and fsyncs
+    whatever has accumulated every sync_interval seconds (group commit), then
+    runs the callbacks waiting on those records. Every snapshot_every records
+    the dictionary is copied and handed to the flusher, which rotates the log
+    and has the snapshot written out in the background, after which the log
+    it covers is dropped.
+    """
+    def __init__(self, directory, sync_interval=0.002, snapshot_every=50000, on_error=None):
+        self.directory = directory
+        self.on_error = on_error  # Called with (what, exception) for failures on background threads
+        self.sync_interval = sync_interval
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+
+        self.cond = threading.Condition()
+        self.io_lock = threading.Lock()  # Held while the log file is written or rotated
+        self.buffer = []
+        self.callbacks = []  # (lsn, callback)
+        self.next_lsn = 0
+        self.durable_lsn = 0
+        self.since_snapshot = 0
+        self.snapshotting = False
+        self.pending_snapshot = None  # (entries, version, records it covers) for the flusher
+        self.file = open(self.path(WAL_FILE), 'ab')
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def recover(self, store):
+        """Load the latest snapshot and replay the log tail into store; returns entries loaded"""
+        snapshot_version = self.load_snapshot(store)
+        replayed = 0
+        for name in (OLD_WAL_FILE, WAL_FILE):
+            for version, perm, grade in self.read_log(self.path(name)):
+                if version > snapshot_version and version > store.version:
+                    store.set(perm, grade, version)
+                    replayed += 1
+        self.since_snapshot = replayed
+        return len(store)
+
+    def load_snapshot(self, store):
+        """Memory-map the snapshot file into store and return its version"""
+        try:
+            f = open(self.path(SNAPSHOT_FILE), 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            if os.fstat(f.fileno()).st_size < len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size:
+                return 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                    raise ValueError(f"{self.path(SNAPSHOT_FILE)} is not a grade snapshot")
+                pos = len(SNAPSHOT_MAGIC)
+                version, count = SNAPSHOT_HEADER.unpack_from(data, pos)
+                pos += SNAPSHOT_HEADER.size
+                entries = []
+                for _ in range(count):
+                    entry_version, created, perm_len, grade_len = SNAPSHOT_ENTRY.unpack_from(data, pos)
+                    pos += SNAPSHOT_ENTRY.size
+                    perm = data[pos:pos + perm_len].decode('utf-8')
+                    pos += perm_len
+                    grade = data[pos:pos + grade_len].decode('utf-8')
+                    pos += grade_len
+                    entries.append((perm, grade, entry_version, created))
+        store.load(entries, version)
+        return version
+
+    def read_log(self, path):
+        """Yield (version, perm, grade) records, stopping at a torn or corrupt tail"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        pos = 0
+        while pos + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, pos)
+            body = data[pos + RECORD_HEADER.size:pos + RECORD_HEADER.size + length]
+            if len(body) < length or zlib.crc32(body) != crc:
+                return
+            version, perm_len, grade_len = RECORD_BODY.unpack_from(body)
+            start = RECORD_BODY.size
+            yield (version,
+                   body[start:start + perm_len].decode('utf-8'),
+                   body[start + perm_len:start + perm_len + grade_len].decode('utf-8'))
+            pos += RECORD_HEADER.size + length
+
+    def append(self, version, perm, grade):
+        """Buffer one applied insert and return its log sequence number"""
+        perm = str(perm).encode('utf-8')
+        grade = str(grade).encode('utf-8')
+        body = RECORD_BODY.pack(version, len(perm), len(grade)) + perm + grade
+        with self.cond:
+            self.buffer.append(RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body)
+            self.next_lsn += 1
+            self.since_snapshot += 1
+            self.cond.notify()
+            return self.next_lsn
+
+    def after_durable(self, lsn, callback):
+        """Run callback (on the flusher thread) once record lsn is on disk"""
+        with self.cond:
+            if lsn <= self.durable_lsn:
+                ready = True
+            else:
+                self.callbacks.append((lsn, callback))
+                ready = False
+        if ready:
+            callback()
+
+    def run(self):
+        """Group-commit loop"""
+        while True:
+            with self.cond:
+                while not self.buffer and self.pending_snapshot is None:
+                    self.cond.wait()
+            # Let concurrent appends join this commit
+            time.sleep(self.sync_interval)
+            with self.io_lock:
+                ready = self.sync_locked()
+            self.fire(ready)
+
+    def sync_locked(self):
+        """Write and fsync buffered records, rotating first if a snapshot is due (caller holds io_lock); returns callbacks now due"""
+        with self.cond:
+            snapshot, self.pending_snapshot = self.pending_snapshot, None
+            records, self.buffer = self.buffer, []
+            lsn = self.next_lsn
+        if snapshot is not None:
+            self.rotate(*snapshot)
+        if records:
+            self.file.write(b''.join(records))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        with self.cond:
+            self.durable_lsn = lsn
+            ready = [entry for entry in self.callbacks if entry[0] <= lsn]
+            if ready:
+                self.callbacks = [entry for entry in self.callbacks if entry[0] > lsn]
+        return ready
+
+    def report(self, what, error):
+        """Pass a background failure to on_error, or print it without one"""
+        if self.on_error:
+            self.on_error(what, error)
+        else:
+            print(f"{what} error: {error}")
+
+    def fire(self, ready):
+        for lsn, callback in ready:
+            try:
+                callback()
+            except Exception as e:
+                self.report('WAL callback', e)
+
+    def maybe_snapshot(self, store):
+        """Start a background snapshot once enough records have been logged"""
+        if self.since_snapshot >= self.snapshot_every and not self.snapshotting:
+            self.snapshot(store)
+
+    def snapshot(self, store):
+        """Copy store and hand it to the flusher to snapshot (caller holds the store's lock)"""
+        self.snapshotting = True
+        entries = store.entries()
+        with self.cond:
+            # Records logged so far are covered by the snapshot; later ones start the new log
+            self.pending_snapshot = (entries, store.version, self.buffer)
+            self.buffer = []
+            self.since_snapshot = 0
+            self.cond.notify()
+
+    def rotate(self, entries, version, records):
+        """Close off the log a snapshot covers, start a new one and write the snapshot (flusher thread, holding io_lock)"""
+        if records:
+            self.file.write(b''.join(records))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.file.close()
+        if os.path.exists(self.path(OLD_WAL_FILE)):
+            # An earlier snapshot never finished; keep its log and add ours to it
+            with open(self.path(OLD_WAL_FILE), 'ab') as old, open(self.path(WAL_FILE), 'rb') as current:
+                shutil.copyfileobj(current, old)
+                old.flush()
+                os.fsync(old.fileno())
+            os.remove(self.path(WAL_FILE))
+        else:
+            os.replace(self.path(WAL_FILE), self.path(OLD_WAL_FILE))
+        self.file = open(self.path(WAL_FILE), 'ab')
+        threading.Thread(target=self.write_snapshot, args=(entries, version), daemon=True).start()
+
+    def write_snapshot(self, entries, version):
+        """Write a snapshot file atomically and drop the log it covers"""
+        tmp_path = self.path(SNAPSHOT_FILE + '.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(SNAPSHOT_MAGIC + SNAPSHOT_HEADER.pack(version, len(entries)))
+                for perm, grade, entry_version, created in entries:
+                    perm = perm.encode('utf-8')
+                    grade = grade.encode('utf-8')
+                    f.write(SNAPSHOT_ENTRY.pack(entry_version, created, len(perm), len(grade)) + perm + grade)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path(SNAPSHOT_FILE))
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            os.remove(self.path(OLD_WAL_FILE))
+        except Exception as e:
+            self.report('WAL snapshot', e)
+        finally:
+            self.snapshotting = False
@@ -0,0 +1,171 @@
+import socket
+import struct
+import json
+import asyncio
+
+# Wire formats. Every connection starts out speaking newline-delimited JSON;
+# the connecting side may offer the binary framing with a WIRE_HELLO and
+# switches to it only once the other side answers with a WIRE_ACK. Peers that
+# predate the handshake ignore the hello, so the connection stays on JSON.
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'bin2'  # bin1 had no request ids in its fixed-shape payloads
+SUPPORTED_FORMATS = [FORMAT_BINARY, FORMAT_JSON]
+NEGOTIATE_TIMEOUT = 1.0
+
+# Binary frame: 4-byte big-endian length of everything after it, 1-byte kind
+FRAME_HEADER = struct.Struct('!IB')
+KIND_JSON = 0
+KIND_REQUEST = 1
+KIND_REPLY = 2
+KIND_RELEASE = 3
+KIND_SUCCESS = 4
+KIND_INSERT = 5
+
+# Fixed-shape payloads
+CONTROL = struct.Struct('!iqq')  # from, clock, rid
+INSERT = struct.Struct('!iqqHH')  # from, clock, rid, len(perm), len(grade)
+
+CONTROL_KINDS = {'REQUEST': KIND_REQUEST, 'REPLY': KIND_REPLY, 'RELEASE': KIND_RELEASE, 'SUCCESS': KIND_SUCCESS}
+CONTROL_TYPES = {kind: msg_type for msg_type, kind in CONTROL_KINDS.items()}
+CONTROL_KEYS = {'type', 'from', 'clock', 'rid'}
+INSERT_KEYS = {'type', 'from', 'clock', 'rid', 'perm', 'grade'}
+
+def choose_format(offered):
+    """Pick the wire format to use from the formats a peer offered"""
+    for fmt in SUPPORTED_FORMATS:
+        if fmt in offered:
+            return fmt
+    return FORMAT_JSON
+
+def encode(message, fmt=FORMAT_JSON):
+    """Encode one message for the given wire format"""
+    if fmt != FORMAT_BINARY:
+        return (json.dumps(message) + '\n').encode('utf-8')
+
+    msg_type = message.get('type')
+    keys = message.keys()
+    if msg_type in CONTROL_KINDS and keys == CONTROL_KEYS:
+        payload = CONTROL.pack(message['from'], message['clock'], message['rid'])
+        return FRAME_HEADER.pack(len(payload) + 1, CONTROL_KINDS[msg_type]) + payload
+    if msg_type == 'INSERT' and keys == INSERT_KEYS and isinstance(message['perm'], str) and isinstance(message['grade'], str):
+        perm = message['perm'].encode('utf-8')
+        grade = message['grade'].encode('utf-8')
+        payload = INSERT.pack(message['from'], message['clock'], message['rid'], len(perm), len(grade)) + perm + grade
+        return FRAME_HEADER.pack(len(payload) + 1, KIND_INSERT) + payload
+
+    # Anything else travels as JSON inside a binary frame
+    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    return FRAME_HEADER.pack(len(payload) + 1, KIND_JSON) + payload
+
+def decode_frame(kind, payload):
+    """Decode the payload of one binary frame"""
+    if kind == KIND_JSON:
+        return json.loads(payload)
+    if kind in CONTROL_TYPES:
+        sender, clock, rid = CONTROL.unpack(payload)
+        return {'type': CONTROL_TYPES[kind], 'from': sender, 'clock': clock, 'rid': rid}
+    if kind == KIND_INSERT:
+        sender, clock, rid, perm_len, grade_len = INSERT.unpack_from(payload)
+        start = INSERT.size
+        perm = payload[start:start + perm_len].decode('utf-8')
+        grade = payload[start + perm_len:start + perm_len + grade_len].decode('utf-8')
+        return {'type': 'INSERT', 'from': sender, 'perm': perm, 'grade': grade, 'clock': clock, 'rid': rid}
+    raise ValueError(f"unknown frame kind {kind}")
+
+class FrameReader:
+    """Incremental decoder for one connection.
+
+    Keeps a single buffer and a read offset, so a burst of many messages is
+    decoded in linear time instead of re-splitting the remaining buffer for
+    every message. The format can be switched between messages.
+    """
+    def __init__(self, fmt=FORMAT_JSON):
+        self.format = fmt
+        self.buffer = bytearray()
+        self.pos = 0
+        self.scan = 0  # Where to resume looking for a newline in JSON mode
+
+    def feed(self, data):
+        """Append received bytes"""
+        if self.pos and self.pos * 2 >= len(self.buffer):
+            # Compact once at least half of the buffer has been consumed
+            del self.buffer[:self.pos]
+            self.scan -= self.pos
+            self.pos = 0
+        self.buffer += data
+
+    def next_message(self):
+        """Return the next complete message, or None if more data is needed"""
+        while True:
+            if self.format == FORMAT_BINARY:
+                if len(self.buffer) - self.pos < FRAME_HEADER.size:
+                    return None
+                length, kind = FRAME_HEADER.unpack_from(self.buffer, self.pos)
+                end = self.pos + 4 + length
+                if len(self.buffer) < end:
+                    return None
+                message = decode_frame(kind, bytes(self.buffer[self.pos + FRAME_HEADER.size:end]))
+                self.pos = self.scan = end
+                return message
+
+            newline = self.buffer.find(b'\n', max(self.scan, self.pos))
+            if newline < 0:
+                self.scan = len(self.buffer)
+                return None
+            line = bytes(self.buffer[self.pos:newline])
+            self.pos = self.scan = newline + 1
+            if line.strip():
+                return json.loads(line)
+
+    def __iter__(self):
+        """Yield complete messages; the format is re-read before each one"""
+        while True:
+            message = self.next_message()
+            if message is None:
+                return
+            yield message
+
+def hello(formats):
+    """Build the WIRE_HELLO offering formats"""
+    return {'type': 'WIRE_HELLO', 'formats': formats}
+
+def ack_format(message):
+    """Return the format accepted by a WIRE_ACK, falling back to JSON"""
+    if message and message.get('type') == 'WIRE_ACK':
+        return message.get('format', FORMAT_JSON)
+    return FORMAT_JSON
+
+def negotiate(sock, formats, timeout=NEGOTIATE_TIMEOUT):
+    """Offer formats on a connected socket; returns (format, reader) and leaves the socket's timeout as it was"""
+    reader = FrameReader()
+    if formats == [FORMAT_JSON]:
+        return FORMAT_JSON, reader
+    sock.sendall(encode(hello(formats)))
+    previous = sock.gettimeout()
+    sock.settimeout(timeout)
+    message = None
+    try:
+        while message is None:
+            data = sock.recv(4096)
+            if not data:
+                break
+            reader.feed(data)
+            message = reader.next_message()
+    except socket.timeout:
+        pass
+    finally:
+        sock.settimeout(previous)
+    reader.format = ack_format(message)
+    return reader.format, reader
+
+async def negotiate_stream(reader, writer, formats, timeout=NEGOTIATE_TIMEOUT):
+    """Offer formats on an asyncio stream; returns the agreed format"""
+    if formats == [FORMAT_JSON]:
+        return FORMAT_JSON
+    writer.write(encode(hello(formats)))
+    await writer.drain()
+    try:
+        line = await asyncio.wait_for(reader.readline(), timeout)
+    except asyncio.TimeoutError:
+        return FORMAT_JSON
+    return ack_format(json.loads(line) if line.strip() else None)